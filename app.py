@@ -4,11 +4,12 @@ import os
 import random
 import logging
 import traceback
-import json
 import pytz
 import certifi
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, Response, g, jsonify
+from flask import (
+    Flask, render_template, request, redirect, url_for, flash, Response, g, jsonify, send_from_directory, abort
+)
 from flask_pymongo import PyMongo
 from flask_login import (
     LoginManager, UserMixin,
@@ -17,10 +18,31 @@ from flask_login import (
 )
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import uuid
-import bcrypt
+import gzip
+from eventlet import tpool
 from bson.objectid import ObjectId
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
+from logging_pipeline import LoggingPipeline, JsonMessage
+from maze import CHUNK_SIZE, RoomMazes, chunk_in_range, default_goal, get_chunk, maze_cache_info
+from broadcast import MoveBroadcaster, PROTOCOL_BINARY, PROTOCOL_JSON, protocol_room, unpack_move_request
+from settlement import StatSettlement
+from user_cache import UserCache
+from leaderboard import Leaderboard, RANKINGS
+from room_state import create_room_state
+from ingame_sync import IngameWriteBehind
+from indexes import ensure_indexes
+from recording import MatchRecorder
+from ratelimit import EventRateLimiter, parse_budgets, throttle_socketio
+from presence import LobbyPresence
+from matchmaking import Matchmaker
+from room_events import JOIN, LEAVE, MOVE, WIN, RoomEventLog
+from progress import ProgressRanking
+from metrics import Metrics, MongoCommandMetrics, instrument_flask, instrument_socketio
+from passwords import PasswordHasher
+from avatars import AvatarStore, InvalidAvatar, is_thumbnail_name
+from assets import AssetManifest
 
 load_dotenv()
 
@@ -44,37 +66,72 @@ app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
 # app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
 app.config["MONGO_URI"] = os.environ.get("MONGODB_URI")
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB
+# "immediate" sends one player_moved per move, "tick" batches moves per room
+app.config["MOVE_BROADCAST_MODE"] = os.environ.get("MOVE_BROADCAST_MODE", "immediate")
+app.config["MOVE_TICK_RATE"] = int(os.environ.get("MOVE_TICK_RATE", 20))  # Hz
+# Let clients that ask for it exchange moves as packed binary frames
+app.config["BINARY_MOVES"] = os.environ.get("BINARY_MOVES", "false").lower() == "true"
+# Interest management: only send moves to players within this many cells (0 = whole room),
+# plus a full position snapshot every MOVE_SNAPSHOT_INTERVAL seconds
+app.config["MOVE_VIEW_RADIUS"] = int(os.environ.get("MOVE_VIEW_RADIUS", 0))
+app.config["MOVE_SNAPSHOT_INTERVAL"] = float(os.environ.get("MOVE_SNAPSHOT_INTERVAL", 2.0))
+# Mirror leaderboard standings into the `leaderboards` collection
+app.config["LEADERBOARD_MATERIALIZE"] = os.environ.get("LEADERBOARD_MATERIALIZE", "false").lower() == "true"
+# Room/presence state: "memory" (single worker) or "redis" (shared by several workers)
+app.config["STATE_BACKEND"] = os.environ.get("STATE_BACKEND", "memory")
+app.config["REDIS_URL"] = os.environ.get("REDIS_URL")
+# e.g. redis://redis:6379/0, so emits reach sockets connected to other workers
+app.config["SOCKETIO_MESSAGE_QUEUE"] = os.environ.get("SOCKETIO_MESSAGE_QUEUE")
 
 # Configure logging directories
 logs_dir = 'logs'
 if not os.path.exists(logs_dir):
     os.makedirs(logs_dir)
 
-# Setup main application logger
-logging.basicConfig(
-    filename=os.path.join(logs_dir, 'server.log'),
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+# Setup logging: handlers only enqueue, a background writer formats and rotates the files
+logging_pipeline = LoggingPipeline(
+    logs_dir, 'http_raw',
+    max_bytes=int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+    backup_count=int(os.environ.get("LOG_BACKUP_COUNT", 5)),
+    queue_size=int(os.environ.get("LOG_QUEUE_SIZE", 10000))
 )
+logging.root.addHandler(logging_pipeline.handler)
+logging.root.setLevel(logging.INFO)
+logging_pipeline.start()
 logger = logging.getLogger('mmo_game')
 
-# Setup separate logger for raw HTTP requests/responses
+# Separate logger for raw HTTP requests/responses (written to http_raw.log only)
 http_logger = logging.getLogger('http_raw')
 http_logger.setLevel(logging.INFO)
-http_handler = logging.FileHandler(os.path.join(logs_dir, 'http_raw.log'))
-http_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-http_logger.addHandler(http_handler)
+
+# Fraction of requests whose raw HTTP request/response is logged
+HTTP_LOG_SAMPLE_RATE = float(os.environ.get("HTTP_LOG_SAMPLE_RATE", 1.0))
 
 # Maximum size for logging raw HTTP content (2048 bytes)
 MAX_HTTP_LOG_SIZE = 2048
 
+# Static files and avatars: never logged raw, and their file bodies go straight to the server
+STATIC_PATH_PREFIXES = ('/assets/', '/static/', '/avatars/')
+
 
 # Class to capture and log response data
 class LoggingMiddleware:
-    def __init__(self, app):
+    def __init__(self, app, sample_rate=1.0, skip_prefixes=()):
         self.app = app
+        self.sample_rate = sample_rate
+        self.skip_prefixes = skip_prefixes
 
     def __call__(self, environ, start_response):
+        # Decide once per request whether its raw HTTP exchange is logged
+        if environ.get('PATH_INFO', '').startswith(self.skip_prefixes):
+            # Wrapping the body would also hide the server's file wrapper and so rule out sendfile
+            sampled = False
+        else:
+            sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        environ['mmo.log_http'] = sampled
+        if not sampled:
+            return self.app(environ, start_response)
+
         # Create a response wrapper to capture status code
         response_captured = {}
 
@@ -85,25 +142,50 @@ class LoggingMiddleware:
 
         # Process request as normal
         output = self.app(environ, _start_response)
+        return LoggedResponse(output, response_captured)
 
-        # Capture the response body, if needed
-        response_body = b''
-        for chunk in output:
-            response_body += chunk
+
+class LoggedResponse:
+    """Pass the response body through untouched, keeping only a bounded prefix for the log."""
+
+    def __init__(self, output, response_captured):
+        self.output = output
+        self.response_captured = response_captured
+        self.prefix = bytearray()
+        self.length = 0
+        self.logged = False
+
+    def __iter__(self):
+        for chunk in self.output:
+            self.length += len(chunk)
+            if len(self.prefix) < MAX_HTTP_LOG_SIZE:
+                self.prefix += chunk[:MAX_HTTP_LOG_SIZE - len(self.prefix)]
             yield chunk
+        self.finish()
 
+    def close(self):
+        try:
+            if hasattr(self.output, 'close'):
+                self.output.close()
+        finally:
+            self.finish()
+
+    def finish(self):
+        if not self.logged:
+            self.logged = True
+            self.log()
+
+    def log(self):
         # Log raw HTTP response (headers only for non-text or if over size limit)
         try:
             is_text = False
-            content_type = None
-            for name, value in response_captured['headers']:
+            for name, value in self.response_captured['headers']:
                 if name.lower() == 'content-type' and ('text/' in value.lower() or 'application/json' in value.lower()):
                     is_text = True
-                    content_type = value
 
             # Remove auth tokens from headers
             filtered_headers = []
-            for name, value in response_captured['headers']:
+            for name, value in self.response_captured['headers']:
                 if name.lower() == 'set-cookie':
                     parts = value.split(';')
                     if any(part.strip().startswith('session=') for part in parts) or any(
@@ -120,30 +202,31 @@ class LoggingMiddleware:
                     filtered_headers.append((name, value))
 
             response_log = {
-                'status': response_captured['status'],
+                'status': self.response_captured['status'],
                 'headers': dict(filtered_headers)
             }
 
             # Log body for text responses if under size limit
-            if is_text and len(response_body) <= MAX_HTTP_LOG_SIZE:
+            if is_text and self.length <= MAX_HTTP_LOG_SIZE:
                 try:
-                    response_log['body'] = response_body.decode('utf-8')
+                    response_log['body'] = bytes(self.prefix).decode('utf-8')
                 except UnicodeDecodeError:
                     response_log['body'] = '[Unable to decode response body]'
             elif is_text:
                 response_log['body'] = f'[Text content truncated to {MAX_HTTP_LOG_SIZE} bytes]'
-                response_log['body_sample'] = response_body[:MAX_HTTP_LOG_SIZE].decode('utf-8', errors='ignore')
+                response_log['body_sample'] = bytes(self.prefix).decode('utf-8', errors='ignore')
             else:
                 response_log['body'] = '[Binary content, headers only]'
 
-            http_logger.info(f"RESPONSE: {json.dumps(response_log)}")
+            http_logger.info("RESPONSE: %s", JsonMessage(response_log))
         except Exception as e:
             logger.error(f"Error logging response: {str(e)}")
             logger.error(traceback.format_exc())
 
 
 # Register middleware
-app.wsgi_app = LoggingMiddleware(app.wsgi_app)
+app.wsgi_app = LoggingMiddleware(app.wsgi_app, sample_rate=HTTP_LOG_SAMPLE_RATE,
+                                 skip_prefixes=STATIC_PATH_PREFIXES)
 
 
 # Middleware to log each request's details
@@ -170,12 +253,16 @@ def log_request_info():
             'cookies': cookies
         }
 
-        # Add username to log if user is authenticated
-        if current_user.is_authenticated:
+        # Add username to log if user is authenticated (static files skip the session and user lookup)
+        if not request.path.startswith(STATIC_PATH_PREFIXES) and current_user.is_authenticated:
             log_data['username'] = current_user.username
 
         # Log to main application log
-        logger.info(json.dumps(log_data))
+        logger.info("%s", JsonMessage(log_data))
+
+        # Raw HTTP logging is sampled per request by LoggingMiddleware
+        if not request.environ.get('mmo.log_http', True):
+            return
 
         # Log raw HTTP request (headers only for sensitive routes or non-text content)
         is_sensitive = request.path in ['/login', '/register']
@@ -223,7 +310,7 @@ def log_request_info():
         elif request.content_length and request.content_length > MAX_HTTP_LOG_SIZE:
             request_log['body'] = f'[Content truncated, over {MAX_HTTP_LOG_SIZE} bytes]'
 
-        http_logger.info(f"REQUEST: {json.dumps(request_log)}")
+        http_logger.info("REQUEST: %s", JsonMessage(request_log))
 
     except Exception as e:
         logger.error(f"Error logging request: {str(e)}")
@@ -241,11 +328,11 @@ def log_response_info(response):
             'timestamp': format_timestamp()
         }
 
-        # Add username to log if user is authenticated
-        if current_user.is_authenticated:
+        # Add username to log if user is authenticated (static files skip the session and user lookup)
+        if not request.path.startswith(STATIC_PATH_PREFIXES) and current_user.is_authenticated:
             log_data['username'] = current_user.username
 
-        logger.info(f"Response: {json.dumps(log_data)}")
+        logger.info("Response: %s", JsonMessage(log_data))
     except Exception as e:
         logger.error(f"Error logging response: {str(e)}")
         logger.error(traceback.format_exc())
@@ -256,6 +343,10 @@ def log_response_info(response):
 # Error handling with logging
 @app.errorhandler(Exception)
 def handle_exception(e):
+    # Let 404s and other HTTP errors keep their status
+    if isinstance(e, HTTPException):
+        return e
+
     # Log the stack trace
     logger.error(f"Unhandled exception: {str(e)}")
     logger.error(traceback.format_exc())
@@ -269,8 +360,16 @@ def request_entity_too_large(error):
     return render_template('error.html', error="Uploaded file is too large (maximum 2MB allowed)."), 413
 
 
-# Initialize MongoDB client
-mongo = PyMongo(app, tls=True, tlsCAFile=certifi.where())
+# Hot-path instrumentation, served on /metrics
+app_metrics = Metrics()
+instrument_flask(app, app_metrics)
+mongo_metrics = MongoCommandMetrics(app_metrics)
+
+# Initialize MongoDB client (MONGO_TLS=false for a local mongod without TLS)
+if os.environ.get("MONGO_TLS", "true").lower() == "true":
+    mongo = PyMongo(app, tls=True, tlsCAFile=certifi.where(), event_listeners=[mongo_metrics])
+else:
+    mongo = PyMongo(app, event_listeners=[mongo_metrics])
 
 
 # Initialize Flask-Login
@@ -284,7 +383,7 @@ class User(UserMixin):
     def __init__(self, user_data):
         self.id = str(user_data['_id'])
         self.username = user_data['username']
-        self.password_hash = user_data['password']
+        self.password_hash = user_data.get('password')
         self.avatar = user_data.get('avatar')
         self.won = user_data.get('won')
         self.lose = user_data.get('lose')
@@ -296,11 +395,38 @@ class User(UserMixin):
         return self.id
 
 
+# Cached User objects for load_user, which runs on every request and socket event
+user_cache = UserCache(max_size=int(os.environ.get("USER_CACHE_SIZE", 4096)),
+                       ttl=float(os.environ.get("USER_CACHE_TTL", 300)))
+
+# bcrypt runs on native threads, at most BCRYPT_MAX_CONCURRENCY at a time
+password_hasher = PasswordHasher(rounds=int(os.environ.get("BCRYPT_ROUNDS", 12)),
+                                 max_concurrency=int(os.environ.get("BCRYPT_MAX_CONCURRENCY", 4)))
+app_metrics.gauge('mmo_bcrypt_waiting', 'Password hashes/checks queued for a bcrypt slot',
+                  lambda: password_hasher.waiting)
+app_metrics.gauge('mmo_bcrypt_active', 'Password hashes/checks running on native threads',
+                  lambda: password_hasher.active)
+app_metrics.counter_callback('mmo_bcrypt_operations_total', 'bcrypt operations',
+                             lambda: {('hash',): password_hasher.hashed, ('check',): password_hasher.checked},
+                             ('operation',))
+
+# Fields no request-scoped User needs; the password is only read by /login
+USER_LOADER_PROJECTION = {'password': 0, 'created_at': 0}
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    user_data = mongo.db.users.find_one({"_id": ObjectId(user_id)})
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    if not ObjectId.is_valid(user_id):
+        return None
+    user_data = mongo.db.users.find_one({"_id": ObjectId(user_id)}, USER_LOADER_PROJECTION)
     if user_data:
-        return User(user_data)
+        user = User(user_data)
+        user_cache.put(user)
+        return user
     return None
 
 
@@ -325,11 +451,10 @@ def register():
             return redirect(url_for('register'))
 
         # Hash the password with bcrypt
-        salt = bcrypt.gensalt()
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), salt)
+        password_hash = password_hasher.hash(password)
 
         # Insert new user into the database
-        mongo.db.users.insert_one({
+        new_user = {
             'username': username,
             'password': password_hash,
             "won": 0,
@@ -338,7 +463,15 @@ def register():
             "exp": 0,
             "level": 1,
             'created_at': format_timestamp()
-        })
+        }
+        try:
+            mongo.db.users.insert_one(new_user)
+        except DuplicateKeyError:
+            # Lost a race with a concurrent registration; the unique index has the final say
+            logger.warning(f"Registration failed: Username '{username}' already exists.")
+            flash('Username already exists.')
+            return redirect(url_for('register'))
+        leaderboard_service.update([{k: new_user[k] for k in ('username', 'won', 'lose', 'played', 'exp', 'level')}])
 
         # Log successful registration
         logger.info(f"Registration successful: User '{username}' created.")
@@ -363,9 +496,11 @@ def login():
             flash('Invalid username or password.')
             return render_template('login.html'), 400
 
-        if bcrypt.checkpw(password.encode('utf-8'), user_data['password']):
+        if password_hasher.check(password, user_data['password']):
             user = User(user_data)
             login_user(user)
+            if password_hasher.needs_rehash(user_data['password']):
+                socketio.start_background_task(rehash_password, user_data['_id'], password)
 
             # Log successful login
             logger.info(f"Login successful: User '{username}' logged in.")
@@ -381,6 +516,15 @@ def login():
     return render_template('login.html')
 
 
+def rehash_password(user_id, password):
+    """Upgrade a stored hash to the configured BCRYPT_ROUNDS after a successful login."""
+    try:
+        mongo.db.users.update_one({'_id': user_id}, {'$set': {'password': password_hasher.hash(password)}})
+        logger.info(f"Login: Rehashed password for user {user_id} with cost {password_hasher.rounds}")
+    except Exception as e:
+        logger.error(f"Login: Failed to rehash password for user {user_id}: {e}")
+
+
 @app.route('/logout')
 @login_required
 def logout():
@@ -400,23 +544,169 @@ socketio = SocketIO(app,
                             "http://localhost:8080",
                             "http://127.0.0.1:8080",
                         ],
-                    async_mode="eventlet")
-online_users = set()
+                    async_mode="eventlet",
+                    message_queue=app.config["SOCKETIO_MESSAGE_QUEUE"])
+instrument_socketio(socketio, app_metrics)
+room_state = create_room_state(app.config["STATE_BACKEND"], app.config["REDIS_URL"])
+# sid -> {room: username} for the game rooms joined by sockets on this worker
+sid_memberships = {}
+
+# Per-socket event budgets: (events per second, burst); each user gets SOCKET_USER_MULTIPLIER times that
+# across all of their sockets. Override with e.g. SOCKET_RATE_LIMITS="move=20/40,start_game=0.5/2"
+SOCKET_EVENT_BUDGETS = {
+    'move': (15, 30),
+    'mv': (15, 30),
+    'join_room': (1, 5),
+    'start_game': (0.2, 3),
+    'find_match': (0.5, 3),
+    'cancel_match': (1, 5),
+    'join_lobby': (1, 5),
+    'leave_lobby': (1, 5),
+    'request_lobby_snapshot': (1, 5),
+}
+socket_limiter = EventRateLimiter(parse_budgets(os.environ.get("SOCKET_RATE_LIMITS"), SOCKET_EVENT_BUDGETS),
+                                  user_multiplier=float(os.environ.get("SOCKET_USER_MULTIPLIER", 3)),
+                                  abuse_drops=int(os.environ.get("SOCKET_ABUSE_DROPS", 50)),
+                                  abuse_window=float(os.environ.get("SOCKET_ABUSE_WINDOW", 10)))
+
+
+def socket_identity():
+    return request.sid, current_user.username if current_user.is_authenticated else None
+
+
+def resync_throttled_move(*args):
+    """The client already moved locally; snap it back to the server's position."""
+    # Moves go to the game room this socket joined last, as in handle_binary_move
+    membership = next(reversed(sid_memberships.get(request.sid, {}).items()), None)
+    if membership is None:
+        return
+    room, username = membership
+    player = room_state.get_player(room, username)
+    if player and player.get('sid') == request.sid:
+        emit('move_rejected', {'row': player['row'], 'col': player['col']})
+
+
+throttle_socketio(socketio, socket_limiter, socket_identity,
+                  on_drop={'move': resync_throttled_move, 'mv': resync_throttled_move})
+# Live sessions are mirrored to `ingame` in the background; nothing reads it on the request path
+ingame_sync = IngameWriteBehind(socketio, mongo, room_state,
+                                delay=float(os.environ.get("INGAME_FLUSH_INTERVAL", 1.0)),
+                                ttl=int(os.environ.get("INGAME_TTL", 6 * 60 * 60)),
+                                finished_ttl=int(os.environ.get("INGAME_FINISHED_TTL", 60 * 60)))
+# Binary move logs per match, served back by /replay/<room>
+record_matches = os.environ.get("RECORD_MATCHES", "true").lower() == "true"
+if record_matches and app.config["STATE_BACKEND"] != "memory":
+    # Only the worker that created a room records it; moves handled elsewhere would be missing
+    logger.warning("Game: RECORD_MATCHES needs STATE_BACKEND=memory; match recording is off.")
+    record_matches = False
+match_recorder = MatchRecorder(socketio, os.environ.get("RECORDINGS_DIR", "recordings"),
+                               enabled=record_matches,
+                               flush_interval=float(os.environ.get("RECORDING_FLUSH_INTERVAL", 1.0)))
+# Recent deltas per game room, so reconnecting clients get what they missed instead of a full rejoin.
+# A player whose socket drops stays in the room for RECONNECT_GRACE seconds.
+room_events = RoomEventLog(size=int(os.environ.get("ROOM_EVENT_BUFFER", 256)))
+RECONNECT_GRACE = float(os.environ.get("RECONNECT_GRACE", 10))
+room_resyncs = app_metrics.counter('mmo_room_resyncs_total', 'Reconnects resumed within the grace period',
+                                   ('kind',))
+lobby_presence = LobbyPresence(socketio, room_state,
+                               debounce=float(os.environ.get("LOBBY_PRESENCE_DEBOUNCE", 0.1)))
+view_radius = app.config["MOVE_VIEW_RADIUS"]
+if view_radius and app.config["STATE_BACKEND"] != "memory":
+    # The spatial grid is per process and would miss players on other workers
+    logger.warning("Game: MOVE_VIEW_RADIUS needs STATE_BACKEND=memory; sending moves to whole rooms.")
+    view_radius = 0
+# Closest-to-goal ranking per room, published every PROGRESS_INTERVAL seconds (0 = off)
+progress_interval = float(os.environ.get("PROGRESS_INTERVAL", 1.0))
+if progress_interval and app.config["STATE_BACKEND"] != "memory":
+    # Each worker would only rank the players whose moves it handles
+    logger.warning("Game: PROGRESS_INTERVAL needs STATE_BACKEND=memory; live progress ranking is off.")
+    progress_interval = 0
+progress_ranking = ProgressRanking(socketio, interval=progress_interval)
+# Grids of the rooms this worker serves; a raid maze takes about a second to build, so off the hub
+room_mazes = RoomMazes(run=tpool.execute)
+move_broadcaster = MoveBroadcaster(socketio,
+                                   mode=app.config["MOVE_BROADCAST_MODE"],
+                                   tick_rate=app.config["MOVE_TICK_RATE"],
+                                   view_radius=view_radius,
+                                   snapshot_interval=app.config["MOVE_SNAPSHOT_INTERVAL"])
+stat_settlement = StatSettlement(socketio, mongo, room_state)
+stat_settlement.add_listener(lambda room, winner, players: user_cache.invalidate_usernames(players))
+
+# Top players per ranking, patched after every settlement instead of sorting users per page view
+leaderboard_service = Leaderboard(mongo, size=10, materialize=app.config["LEADERBOARD_MATERIALIZE"],
+                                  refresh_interval=None if app.config["STATE_BACKEND"] == "memory" else 30)
+stat_settlement.add_listener(lambda room, winner, players: leaderboard_service.refresh_usernames(players))
+stat_settlement.add_listener(lambda room, winner, players: ingame_sync.finish(room, winner))
+
+
+def bootstrap_database():
+    # Indexes first: the leaderboard warm-up reads through the rank_* indexes
+    ensure_indexes(mongo.db)
+    ingame_sync.expire_legacy()
+    leaderboard_service.backfill()
+    leaderboard_service.warm()
+
+
+socketio.start_background_task(bootstrap_database)
+
+
+def room_player_counts():
+    return [len(room_state.player_names(room)) for room in room_state.all_rooms()]
+
+
+app_metrics.gauge('mmo_live_rooms', 'Game rooms with players on the room backend',
+                  lambda: len(room_state.all_rooms()))
+app_metrics.gauge('mmo_room_players', 'Players in game rooms', lambda: sum(room_player_counts()))
+app_metrics.gauge('mmo_room_players_max', 'Players in the fullest game room',
+                  lambda: max(room_player_counts(), default=0))
+app_metrics.gauge('mmo_lobby_users', 'Users online in the lobby', lambda: len(room_state.online_users()))
+app_metrics.gauge('mmo_ingame_pending_rooms', 'Game rooms with changes not yet written to ingame',
+                  ingame_sync.pending)
+app_metrics.counter_callback('mmo_ingame_writes_total', 'Game sessions written to ingame',
+                             lambda: ingame_sync.writes)
+app_metrics.counter_callback('mmo_recording_records_total', 'Match recording records buffered',
+                             lambda: match_recorder.records)
+app_metrics.counter_callback('mmo_recording_bytes_written_total', 'Match recording bytes written to disk',
+                             lambda: match_recorder.bytes_written)
+app_metrics.counter_callback('mmo_recording_flush_seconds_total', 'Time spent writing match recordings',
+                             lambda: match_recorder.flush_seconds)
+app_metrics.gauge('mmo_recording_buffered_bytes', 'Match recording bytes waiting to be written',
+                  match_recorder.pending_bytes)
+app_metrics.counter_callback('mmo_socket_throttled_total', 'Socket.IO events dropped by the rate limiter',
+                             lambda: {(event,): n for event, n in socket_limiter.throttled.items()}, ('event',))
+app_metrics.counter_callback('mmo_socket_abuse_disconnects_total', 'Sockets disconnected for flooding events',
+                             lambda: socket_limiter.disconnects)
+app_metrics.gauge('mmo_progress_rooms', 'Game rooms with a live progress ranking', progress_ranking.rooms)
+app_metrics.counter_callback('mmo_progress_published_total', 'Progress rankings published to rooms',
+                             lambda: progress_ranking.published)
+app_metrics.gauge('mmo_socket_memberships', 'Game-room sockets connected to this worker',
+                  lambda: len(sid_memberships))
+app_metrics.counter_callback('mmo_user_cache_requests_total', 'load_user cache lookups',
+                             lambda: {('hit',): user_cache.hits, ('miss',): user_cache.misses}, ('result',))
+app_metrics.gauge('mmo_user_cache_size', 'Users in the load_user cache', lambda: user_cache.stats()['size'])
+app_metrics.gauge('mmo_room_mazes', 'Maze grids held for live game rooms', lambda: len(room_mazes))
+app_metrics.counter_callback('mmo_maze_cache_requests_total', 'Maze grid cache lookups',
+                             lambda: {('hit',): maze_cache_info().hits, ('miss',): maze_cache_info().misses},
+                             ('result',))
+app_metrics.counter_callback('mmo_log_records_dropped_total', 'Log records dropped because the queue was full',
+                             lambda: logging_pipeline.dropped)
+app_metrics.gauge('mmo_log_queue_depth', 'Log records waiting for the writer thread',
+                  logging_pipeline.queue_depth)
 
 
 @app.route('/lobby')
 @login_required
 def lobby():
-    return render_template('lobby.html', username=current_user.username)
+    return render_template('lobby.html', username=current_user.username,
+                           maze_presets=MAZE_PRESETS, default_maze_preset=DEFAULT_MAZE_PRESET)
 
 
 @socketio.on('join_lobby')
 def handle_join_lobby():
     if current_user.is_authenticated:
         username = current_user.username
-        online_users.add(username)
         join_room('lobby')
-        emit('update_user_list', list(online_users), room='lobby')
+        lobby_presence.join(username, request.sid)
 
         # Log user joined lobby
         logger.info(f"Socket: User '{username}' joined lobby.")
@@ -426,157 +716,345 @@ def handle_join_lobby():
 def handle_leave_lobby():
     if current_user.is_authenticated:
         username = current_user.username
-        online_users.discard(username)
         leave_room('lobby')
-        emit('update_user_list', list(online_users), room='lobby')
+        lobby_presence.leave(username)
+        matchmaker.leave(username, request.sid)
 
         # Log user left lobby
         logger.info(f"Socket: User '{username}' left lobby.")
 
 
+@socketio.on('request_lobby_snapshot')
+def handle_request_lobby_snapshot():
+    # Clients ask for this after detecting a gap in the presence sequence
+    if current_user.is_authenticated:
+        lobby_presence.send_snapshot(request.sid)
+
+
 @socketio.on('disconnect')
 def handle_disconnect():
     if current_user.is_authenticated:
         username = current_user.username
-        online_users.discard(username)
         leave_room('lobby')
-        emit('update_user_list', list(online_users), room='lobby')
-        mongo.db.ingame.update_one({"players": username}, {"$pull": {"players": username}})
+        lobby_presence.leave(username)
+        matchmaker.leave(username, request.sid)
 
         # Log user disconnected
         logger.info(f"Socket: User '{username}' disconnected.")
 
-    sid = request.sid
+    socket_limiter.forget(request.sid)
+
+    # Only the rooms this socket joined; a newer socket may already own the player record
+    for room, username in sid_memberships.pop(request.sid, {}).items():
+        if RECONNECT_GRACE > 0:
+            socketio.start_background_task(remove_player_later, room, username, request.sid)
+        else:
+            remove_player(room, username, request.sid)
+
+
+def remove_player_later(room, username, sid):
+    socketio.sleep(RECONNECT_GRACE)
+    remove_player(room, username, sid)
+
+
+def remove_player(room, username, sid):
+    """Take a player out of a room, unless a newer socket (e.g. a reconnect) owns them by now."""
+    player = room_state.get_player(room, username)
+    if player is None or player.get('sid') != sid:
+        return
+    room_state.remove_player(room, username)
+    move_broadcaster.untrack(room, username)
+    progress_ranking.untrack(room, username)
+    match_recorder.leave(room, player.get('id', 0), player['row'], player['col'])
+    ingame_sync.touch(room)
+    seq = room_events.record(room, LEAVE, username)
+    socketio.emit('player_left', {'username': username, 'seq': seq}, room=room)
+    names = room_state.player_names(room)
+    socketio.emit('update_players', names, room=room)
+    if not names:
+        room_events.discard(room)
+        release_room(room)
+
+    # Log player left game
+    logger.info(f"Game: Player '{username}' left game room '{room}'.")
+
+
+# Maze sizes offered in the lobby (rows, cols); the goal is the bottom-right open cell
+MAZE_PRESETS = {
+    'classic': (20, 20),
+    'large': (100, 100),
+    'raid': (1000, 1000),
+}
+DEFAULT_MAZE_PRESET = 'classic'
+# Bigger mazes are streamed to clients in chunks instead of generated in the browser
+MAZE_STREAM_MIN_CELLS = 64 * 64
+
+
+def create_game(size, room=None):
+    """Set up a new game room and return its game_start payload, or None if the room already exists."""
+    seed = random.randint(0, 2 ** 31 - 1)
+    room = room or str(uuid.uuid4())
+    rows, cols = MAZE_PRESETS[size]
+    goal_row, goal_col = default_goal(rows, cols)
+    # A live room is never re-seeded (or un-settled) by a repeated start_game
+    if room_state.get_room(room) is not None:
+        return None
+
+    # The grid is built when the first player joins, so rooms nobody joins cost nothing
+    if not room_state.create_room(room, seed, rows, cols, (goal_row, goal_col)):
+        return None
+    ingame_sync.touch(room)
+    match_recorder.start(room, seed, rows, cols, goal_row, goal_col)
+    return {'room': room, 'seed': seed, 'rows': rows, 'cols': cols, 'goal': [goal_row, goal_col]}
+
+
+def release_room(room):
+    """Drop the per-room working state of a room that was won or emptied."""
+    room_mazes.discard(room)
+    move_broadcaster.discard(room)
+
+
+def maze_size(data):
+    return data.get('size') if data.get('size') in MAZE_PRESETS else DEFAULT_MAZE_PRESET
+
+
+def start_match(size, players):
+    game = create_game(size)
+    game['players'] = [username for username, _ in players]
+    logger.info(f"Game: Matched {game['players']} into a new {game['rows']}x{game['cols']} game "
+                f"with room '{game['room']}' and seed {game['seed']}.")
+    # Only this group hears about the room; the client goes to /game?room=xxx
+    socketio.emit('game_start', game, to=[sid for _, sid in players])
+
+
+# Groups lobby players into rooms of MATCH_CAPACITY, optionally by MATCH_LEVEL_BUCKET levels at a time;
+# after MATCH_MAX_WAIT seconds a group starts with at least MATCH_MIN_PLAYERS
+matchmaker = Matchmaker(socketio, start_match,
+                        capacity=int(os.environ.get("MATCH_CAPACITY", 4)),
+                        min_players=int(os.environ.get("MATCH_MIN_PLAYERS", 2)),
+                        max_wait=float(os.environ.get("MATCH_MAX_WAIT", 20)),
+                        level_bucket=int(os.environ.get("MATCH_LEVEL_BUCKET", 0)))
+app_metrics.gauge('mmo_matchmaking_waiting', 'Players waiting for a match', lambda: {
+    (size,): matchmaker.waiting_by_size().get(size, 0) for size in MAZE_PRESETS}, ('size',))
+app_metrics.counter_callback('mmo_matchmaking_matches_total', 'Matches formed by the matchmaker',
+                             lambda: {('full',): matchmaker.matches - matchmaker.timeouts,
+                                      ('max_wait',): matchmaker.timeouts}, ('reason',))
+app_metrics.counter_callback('mmo_matchmaking_matched_players_total', 'Players placed into matches',
+                             lambda: matchmaker.matched_players)
+app_metrics.counter_callback('mmo_matchmaking_wait_seconds_total', 'Time matched players spent queued',
+                             lambda: matchmaker.wait_seconds)
+
+
+@socketio.on('find_match')
+def handle_find_match(data=None):
+    if not current_user.is_authenticated:
+        return
+    username = current_user.username
+    size = maze_size(data or {})
+    waiting = matchmaker.join(username, request.sid, size, current_user.level)
+    # A full group may already have started (and sent game_start) on this join
+    if matchmaker.is_queued(username):
+        emit('matchmaking_queued', {'size': size, 'waiting': waiting, 'capacity': matchmaker.capacity,
+                                    'max_wait': matchmaker.max_wait})
+        logger.info(f"Socket: User '{username}' is looking for a {size} match.")
 
-    for room, players in rooms.items():
-        for username, player in list(players.items()):
-            if player.get('sid') == sid:
-                del rooms[room][username]
-                emit('player_left', username, room=room)
-                emit('update_players', list(rooms[room].keys()), room=room)
 
-                # Log player left game
-                logger.info(f"Game: Player '{username}' left game room '{room}'.")
-                break
+@socketio.on('cancel_match')
+def handle_cancel_match():
+    if current_user.is_authenticated and matchmaker.leave(current_user.username):
+        emit('matchmaking_cancelled')
+        logger.info(f"Socket: User '{current_user.username}' stopped looking for a match.")
 
 
 @socketio.on('start_game')
 def handle_start_game(data):
-    # 1) Generate a unique room name for this game
-    seed = random.randint(0, 2 ** 31 - 1)
-    room = data.get('room') or str(uuid.uuid4())
-    mongo.db.ingame.delete_many({"players": []})
-    mongo.db.ingame.insert_one({"room": room, "players": []})
-
-    # Log game starting
+    # A private game: only the requester is sent there, others join through its /game?room= link
+    game = create_game(maze_size(data), data.get('room'))
+    if game is None:
+        logger.warning(f"Game: Refused start_game for existing room '{data.get('room')}'.")
+        emit('game_start_rejected', {'room': data.get('room')})
+        return
     if current_user.is_authenticated:
-        logger.info(f"Game: User '{current_user.username}' started a new game with room '{room}' and seed {seed}.")
-
-    # 2) Notify all clients in the lobby: game started, go to /game?room=xxx
-    emit('game_start', {'room': room, 'seed': seed}, room='lobby')
-
-
-rooms = {}
+        logger.info(f"Game: User '{current_user.username}' started a new {game['rows']}x{game['cols']} game "
+                    f"with room '{game['room']}' and seed {game['seed']}.")
+    emit('game_start', game)
 
 
 @socketio.on('join_room')
 def handle_join_room(data):
+    if not current_user.is_authenticated:
+        return
     room = data['room']
-    username = data['username']
-    avatar_filename = current_user.avatar
-    avatar_url = url_for('static', filename=f'uploads/{avatar_filename}') if avatar_filename else None
+    # The session decides who joins; a client-sent username could take over someone else's record
+    username = current_user.username
+    player_avatar_url = avatar_url(current_user.avatar)
     sid = request.sid
+    protocol = PROTOCOL_BINARY if (app.config["BINARY_MOVES"] and data.get('protocol') == PROTOCOL_BINARY) \
+        else PROTOCOL_JSON
 
     join_room(room)
+    join_room(protocol_room(room, protocol))
+
+    existing = room_state.get_player(room, username)
+    if existing is not None and 'since' in data:
+        resume_player(room, existing, sid, protocol, data['since'])
+        return
 
     # Log player joined game room
     logger.info(f"Game: Player '{username}' joined game room '{room}'.")
 
-    if room not in rooms:
-        rooms[room] = {}
+    # Small per-room id that stands in for the username in binary frames; a rejoin keeps its id.
+    # Ids wrap at 65536 so they always fit the uint16 field.
+    player_id = existing['id'] if existing and 'id' in existing else room_state.next_player_id(room) % 65536
 
-    rooms[room][username] = {
+    room_state.add_player(room, {
+        'id': player_id,
         'username': username,
-        'avatarUrl': avatar_url,
+        'avatarUrl': player_avatar_url,
         'row': 1,
         'col': 1,
         'sid': sid
-    }
+    })
+    sid_memberships.setdefault(sid, {})[room] = username
+    move_broadcaster.track(room, username, 1, 1, sid, protocol, player_id)
+    config = room_state.get_room(room)
+    if config is not None and not config['settled']:
+        # Build the grid (and distance-to-goal field) now rather than on the first move
+        room_mazes.maze(room, config)
+        if progress_ranking.interval:
+            progress_ranking.track(room, username, 1, 1, room_mazes.distances(room, config))
+    match_recorder.join(room, player_id, username, 1, 1)
+    seq = room_events.record(room, JOIN, username)
 
     # Acknowledge to the joining client: who is already in the room
-    others = [v for k, v in rooms[room].items() if k != username]
-    emit('join_game_ack', {'players': others})
+    others = [public_player(v) for k, v in room_state.get_players(room).items() if k != username]
+    emit('join_game_ack', {'players': others, 'id': player_id, 'protocol': protocol, 'seq': seq})
 
     # Notify others: a new player has joined
     emit('player_joined', {
+        'id': player_id,
         'username': username,
-        'avatarUrl': avatar_url,
+        'avatarUrl': player_avatar_url,
         'row': 1,
-        'col': 1
+        'col': 1,
+        'seq': seq
     }, room=room, include_self=False)
 
-    mongo.db.ingame.update_one({"room": room}, {"$push": {"players": username}})
+    ingame_sync.touch(room)
     # Sync player list for everyone
-    emit('update_players', list(rooms[room].keys()), room=room)
+    emit('update_players', room_state.player_names(room), room=room)
+
+
+def public_player(record):
+    return {k: v for k, v in record.items() if k != 'sid'}
+
+
+def resume_player(room, player, sid, protocol, since):
+    """Hand a player still in the room (e.g. within the reconnect grace period) to a new socket.
+
+    Nobody else is told: they never saw the player leave. The client gets a
+    room_resync with what changed after the seq it saw last, or a snapshot.
+    """
+    username = player['username']
+    player['sid'] = sid
+    room_state.add_player(room, player)
+    sid_memberships.setdefault(sid, {})[room] = username
+    move_broadcaster.track(room, username, player['row'], player['col'], sid, protocol, player.get('id'))
+
+    config, players = room_state.get_room(room), room_state.get_players(room)
+    if progress_ranking.interval and config is not None and not config['settled']:
+        progress_ranking.track(room, username, player['row'], player['col'], room_mazes.distances(room, config))
+    # Sequences are per worker, so they only line up when this worker sees every room event
+    changes = room_events.since(room, since) if app.config["STATE_BACKEND"] == "memory" else None
+    resync = {
+        'seq': room_events.seq(room),
+        'id': player.get('id'),
+        'protocol': protocol,
+        'row': player['row'],
+        'col': player['col'],
+        'snapshot': changes is None,
+        'finished': bool(config and config['settled']),
+        'winner': None,
+    }
+    if changes is None:
+        resync['players'] = [public_player(p) for name, p in players.items() if name != username]
+        resync['left'] = []
+    else:
+        changed, left, winner = changes
+        resync['players'] = [public_player(players[name]) for name in changed
+                             if name != username and name in players]
+        resync['left'] = sorted(left)
+        resync['winner'] = winner
+    emit('room_resync', resync)
+    room_resyncs.inc('snapshot' if changes is None else 'delta')
+    detail = 'snapshot' if changes is None else f"{len(resync['players'])} change(s)"
+    logger.info(f"Game: Player '{username}' reconnected to game room '{room}' ({detail}).")
+
+
+def validate_move(room, config, player, row, col):
+    """True if (row, col) is a legal single step for the player in an unfinished room."""
+    if type(row) is not int or type(col) is not int:
+        return False
+    if player is None or config is None or config['settled'] or player.get('sid') != request.sid:
+        return False
+    maze = room_mazes.maze(room, config)
+    return maze.is_legal_step(player['row'], player['col'], row, col)
 
 
 @socketio.on('move')
 def handle_move(data):
-    room = data['room']
-    username = data['username']
-    row = data['row']
-    col = data['col']
+    apply_move(data.get('room'), data.get('username'), data.get('row'), data.get('col'))
+
+
+@socketio.on('mv')
+def handle_binary_move(data):
+    """Binary move: packed (row, col) for the game room this socket joined last."""
+    move = unpack_move_request(data)
+    memberships = sid_memberships.get(request.sid)
+    if move is None or not memberships:
+        return
+    room, username = next(reversed(memberships.items()))
+    apply_move(room, username, *move)
+
+
+def apply_move(room, username, row, col):
+    # Drop illegal or teleporting moves before they reach the room or Mongo
+    config, player = room_state.get_room_and_player(room, username)
+    if not validate_move(room, config, player, row, col):
+        if config is not None and config['settled']:
+            # Won on another worker; this one no longer needs the room's grid
+            release_room(room)
+        if player and player.get('sid') == request.sid:
+            emit('move_rejected', {'row': player['row'], 'col': player['col']})
+        logger.debug(f"Game: Rejected move by '{username}' to ({row}, {col}) in room '{room}'.")
+        return
 
     # Update the server-side record of the player's position
-    if room in rooms and username in rooms[room]:
-        rooms[room][username]['row'] = row
-        rooms[room][username]['col'] = col
+    room_state.update_position(room, player, row, col)
+    match_recorder.move(room, player.get('id', 0), row, col)
+    seq = room_events.record(room, MOVE, username)
+    progress_ranking.move(room, username, row, col)
 
     # Broadcast the move to other players (excluding the mover)
-    emit('player_moved', {
-        'username': username,
-        'row': row,
-        'col': col
-    }, room=room, include_self=False)
+    move_broadcaster.publish(room, username, row, col, sid=request.sid, player_id=player.get('id'), seq=seq)
 
-    goal_row = 19
-    goal_col = 19
+    goal_row = config['goal_row']
+    goal_col = config['goal_col']
     # goal_row = 1
     # goal_col = 2
     # goal_row2 = 2
     # goal_col2 = 1
     # if (row == goal_row and col == goal_col) or (row == goal_row2 and col == goal_col2):
     if row == goal_row and col == goal_col:
+        # Only the first goal event of a room pays out; stats are written in the background
+        if not stat_settlement.settle(room, username, room_state.player_names(room)):
+            return
         logger.info(f"Game: Player '{username}' has won the game in room '{room}'!")
-        players = mongo.db.ingame.find_one({"room": room})
-        players = players["players"]
-        for player in players:
-            if player == username:
-                mongo.db.users.update_one({"username": username}, {"$inc": {"won": 1}})
-                mongo.db.users.update_one({"username": username}, {"$inc": {"exp": 10}})
-                temp = mongo.db.users.find_one({"username": player})
-                if temp:
-                    if temp.get("exp", 0) >= 30:
-                        new_level = temp.get("level", 1) + 1
-                        new_exp = temp["exp"] - 30
-                        mongo.db.users.update_one(
-                            {"username": player},
-                            {"$set": {"level": new_level, "exp": new_exp}}
-                        )
-            else:
-                mongo.db.users.update_one({"username": player}, {"$inc": {"lose": 1}})
-                mongo.db.users.update_one({"username": player}, {"$inc": {"exp": 2}})
-                temp = mongo.db.users.find_one({"username": player})
-                if temp:
-                    if temp.get("exp", 0) >= 30:
-                        new_level = temp.get("level", 1) + 1
-                        new_exp = temp["exp"] - 30
-                        mongo.db.users.update_one(
-                            {"username": player},
-                            {"$set": {"level": new_level, "exp": new_exp}}
-                        )
-            mongo.db.users.update_one({"username": player}, {"$inc": {"played": 1}})
-        emit('player_won', {'winner': username}, room=room)
+        match_recorder.finish(room, player.get('id', 0), row, col)
+        move_broadcaster.flush(room)
+        progress_ranking.finish(room)
+        release_room(room)
+        emit('player_won', {'winner': username, 'seq': room_events.record(room, WIN, username)}, room=room)
 
 
 # Routes
@@ -584,15 +1062,122 @@ def handle_move(data):
 @login_required
 def game():
     room = request.args.get('room')
-    return render_template('game.html', room=room, username=current_user.username)
+    config = room_state.get_room(room) if room else None
+    if config is None:
+        flash('That game no longer exists.')
+        return redirect(url_for('lobby'))
+    streamed = config['rows'] * config['cols'] >= MAZE_STREAM_MIN_CELLS
+    maze = {
+        'seed': config['seed'],
+        'rows': config['rows'],
+        'cols': config['cols'],
+        'goal': [config['goal_row'], config['goal_col']],
+        # Chunk edge length when the client should fetch /maze chunks instead of generating the maze
+        'chunk': CHUNK_SIZE if streamed else None,
+    }
+    return render_template('game.html', room=room, username=current_user.username, maze=maze)
+
+
+@app.route('/maze/<room>/<int:chunk_row>/<int:chunk_col>')
+@login_required
+def maze_chunk(room, chunk_row, chunk_col):
+    """One bit-packed CHUNK_SIZE square of a room's maze (1 = wall, row-major, LSB first), gzipped."""
+    config = room_state.get_room(room)
+    if config is None:
+        abort(404)
+    seed, rows, cols = config['seed'], config['rows'], config['cols']
+    if not chunk_in_range(rows, cols, chunk_row, chunk_col):
+        abort(404)
+    # Cut from the room's own grid; only the compressed chunks are cached globally
+    data = tpool.execute(get_chunk, room_mazes.maze(room, config), chunk_row, chunk_col)
+
+    if 'gzip' in request.accept_encodings:
+        response = Response(data, mimetype='application/octet-stream')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(data), mimetype='application/octet-stream')
+    response.vary.add('Accept-Encoding')
+    # A room's maze never changes
+    response.headers['Cache-Control'] = 'private, max-age=86400, immutable'
+    response.set_etag(f"{seed}-{rows}x{cols}-{chunk_row}-{chunk_col}")
+    return response.make_conditional(request)
+
+
+@app.route('/replay/<room>')
+@login_required
+def replay(room):
+    """Stream a recorded match: NDJSON (header line, then one event per line) or ?format=raw."""
+    raw = request.args.get('format') == 'raw'
+    stream = match_recorder.replay(room, raw=raw)
+    if stream is None:
+        abort(404)
+    return Response(stream, mimetype='application/octet-stream' if raw else 'application/x-ndjson')
 
 
 # Configuration for file uploads
+# Legacy full-size uploads; new avatars are thumbnails in AVATAR_FOLDER
 UPLOAD_FOLDER = 'static/uploads'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+app.config['AVATAR_FOLDER'] = os.environ.get("AVATAR_FOLDER", os.path.join(app.root_path, 'static', 'avatars'))
+avatar_store = AvatarStore(app.config['AVATAR_FOLDER'],
+                           size=int(os.environ.get("AVATAR_SIZE", 128)),
+                           webp=os.environ.get("AVATAR_WEBP", "false").lower() == "true")
+AVATAR_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@app.template_global()
+def avatar_url(avatar):
+    """URL for a user's avatar field: a content-addressed thumbnail or a legacy upload."""
+    if not avatar:
+        return None
+    if is_thumbnail_name(avatar):
+        return url_for('serve_avatar', name=avatar)
+    return url_for('static', filename=f'uploads/{avatar}')
+
+
+@app.route('/avatars/<name>')
+def serve_avatar(name):
+    if not is_thumbnail_name(name):
+        abort(404)
+    # The name is a hash of the content, so it doubles as a strong ETag
+    response = send_from_directory(avatar_store.directory, name, etag=name.split('.')[0],
+                                   max_age=AVATAR_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={AVATAR_MAX_AGE}, immutable'
+    return response
+
+
+# Content-hashed copies of static/ with gzip/brotli variants, built by assets.py
+static_assets = AssetManifest(app.static_folder)
+static_assets.load()
+STATIC_ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@app.template_global()
+def asset_url(filename):
+    """Like url_for('static', filename=...), but to the fingerprinted, long-cached copy."""
+    name = static_assets.hashed_name(filename)
+    if name is None:
+        return url_for('static', filename=filename)
+    return url_for('serve_asset', name=name)
+
+
+@app.route('/assets/<name>')
+def serve_asset(name):
+    found = static_assets.lookup(name, request.accept_encodings)
+    if found is None:
+        abort(404)
+    path, encoding, etag, mimetype = found
+    response = send_from_directory(static_assets.directory, path, mimetype=mimetype, etag=etag,
+                                   max_age=STATIC_ASSET_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={STATIC_ASSET_MAX_AGE}, immutable'
+    return response
+
 
 def allowed_file(filename):
     return (
@@ -617,15 +1202,19 @@ def upload_picture():
         return redirect(request.referrer or '/')
 
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        try:
+            filename = avatar_store.save(file.read())
+        except InvalidAvatar as e:
+            logger.warning(f"Upload failed: User '{current_user.username}' uploaded an unreadable image: {e}")
+            flash('Invalid image file')
+            return redirect(request.referrer or '/')
 
         # Save the avatar filename to the current user's document
         mongo.db.users.update_one(
             {'_id': ObjectId(current_user.get_id())},
             {'$set': {'avatar': filename}}
         )
+        user_cache.update(current_user.get_id(), avatar=filename)
 
         logger.info(f"Upload successful: User '{current_user.username}' uploaded avatar '{filename}'.")
         flash('Upload successful!')
@@ -646,14 +1235,22 @@ def record():
 
 @app.route('/leaderboard')
 def leaderboard():
-    top_players = mongo.db.users.find(
-        {},
-        {'username': 1, 'won': 1, '_id': 0}
-    ).sort('won', -1).limit(10)
-
-    players = list(top_players)
+    players = leaderboard_service.top('wins', 10)
     return render_template('leaderboard.html', players=players)
 
+
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    ranking = request.args.get('by', 'wins')
+    if ranking not in RANKINGS:
+        return jsonify({"error": f"Unknown ranking, expected one of: {', '.join(RANKINGS)}"}), 400
+
+    return jsonify({
+        "ranking": ranking,
+        "title": RANKINGS[ranking].title,
+        "players": leaderboard_service.top(ranking, request.args.get('limit', type=int))
+    })
+
 @app.route('/api/userinfo')
 @login_required
 def api_userinfo():
@@ -679,6 +1276,14 @@ def api_userinfo():
 def achievements():
     return render_template('achievements.html')
 
+@app.route('/metrics')
+def metrics():
+    # Optional bearer token so the endpoint can be exposed publicly
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return Response("unauthorized\n", status=401, mimetype='text/plain')
+    return Response(app_metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Error template route - for error handling testing
 @app.route('/trigger-error')
 def trigger_error():
@@ -0,0 +1,155 @@
+"""
+Fingerprinted, precompressed static assets.
+
+build() copies every file under static/ (except user uploads) to
+static/dist/ under a content-hashed name, e.g. game.3f2a9c1d04be.js, next to
+gzip and (if the brotli package is installed) brotli variants of the
+compressible ones, and records the mapping in static/dist/manifest.json.
+Since a hashed name never changes content, it can be cached by browsers
+forever; a new deploy simply references new names.
+
+All the work happens at build time (`python assets.py`, run in the Docker
+image) or once at startup when the manifest is missing or out of date.
+Serving a request is a dict lookup plus sendfile of a file that already
+exists in the right encoding.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger('mmo_game')
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+# User content under static/ is not part of the build
+SKIP_DIRS = {DIST_DIR, 'uploads', 'avatars'}
+COMPRESSIBLE = {'.js', '.css', '.svg', '.json', '.txt', '.html', '.map'}
+# Precompressed variants in order of preference: (Content-Encoding, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _sources(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if not (root == static_folder and d in SKIP_DIRS))
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, static_folder).replace(os.sep, '/'), path
+
+
+def _write(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build(static_folder):
+    """(Re)build static/dist and its manifest; returns the manifest."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    os.makedirs(dist, exist_ok=True)
+    files = {}
+    for filename, path in _sources(static_folder):
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        base, ext = os.path.splitext(filename)
+        hashed = f"{base.replace('/', '.')}.{digest}{ext}"
+        target = os.path.join(dist, hashed)
+        encodings = []
+        if ext.lower() in COMPRESSIBLE:
+            for encoding, suffix in ENCODINGS:
+                if encoding == 'br' and brotli is None:
+                    continue
+                if not os.path.exists(target + suffix):
+                    compressed = brotli.compress(data, quality=11) if encoding == 'br' else \
+                        gzip.compress(data, compresslevel=9, mtime=0)
+                    if len(compressed) >= len(data):
+                        continue
+                    _write(target + suffix, compressed)
+                encodings.append(encoding)
+        if not os.path.exists(target):
+            _write(target, data)
+        stat = os.stat(path)
+        files[filename] = {'name': hashed, 'etag': digest, 'encodings': encodings,
+                           'source': [stat.st_size, stat.st_mtime_ns]}
+    manifest = {'brotli': brotli is not None, 'files': files}
+    _write(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=1, sort_keys=True).encode())
+    return manifest
+
+
+def _up_to_date(static_folder, manifest):
+    files = manifest.get('files', {})
+    if manifest.get('brotli', False) != (brotli is not None):
+        return False
+    seen = 0
+    for filename, path in _sources(static_folder):
+        entry = files.get(filename)
+        if entry is None:
+            return False
+        stat = os.stat(path)
+        if entry['source'] != [stat.st_size, stat.st_mtime_ns]:
+            return False
+        seen += 1
+    return seen == len(files)
+
+
+class AssetManifest:
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.directory = os.path.join(static_folder, DIST_DIR)
+        # source filename -> entry, and hashed name -> entry
+        self.files = {}
+        self.by_name = {}
+
+    def load(self):
+        """Load the manifest, rebuilding it first if any source changed since it was built."""
+        manifest = None
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
+        try:
+            if manifest is None or not _up_to_date(self.static_folder, manifest):
+                manifest = build(self.static_folder)
+                logger.info(f"Assets: Built {len(manifest['files'])} static asset(s).")
+        except OSError as e:
+            # Templates fall back to the unhashed /static/ URLs
+            logger.error(f"Assets: Failed to build static assets: {str(e)}")
+            return
+        self.files = manifest['files']
+        self.by_name = {entry['name']: entry for entry in self.files.values()}
+
+    def hashed_name(self, filename):
+        entry = self.files.get(filename)
+        return entry['name'] if entry else None
+
+    def lookup(self, name, accepted):
+        """(file name in dist, Content-Encoding or None, ETag, mimetype) for a hashed name, or None.
+
+        accepted is the client's Accept-Encoding, e.g. request.accept_encodings.
+        """
+        entry = self.by_name.get(name)
+        if entry is None:
+            return None
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        for encoding, suffix in ENCODINGS:
+            if encoding in entry['encodings'] and encoding in accepted:
+                return name + suffix, encoding, f"{entry['etag']}-{encoding}", mimetype
+        return name, None, entry['etag'], mimetype
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    built = build(folder)
+    for source, info in sorted(built['files'].items()):
+        print(f"{source} -> {DIST_DIR}/{info['name']} {' '.join(info['encodings'])}")
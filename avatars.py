@@ -0,0 +1,81 @@
+"""
+Avatar thumbnails.
+
+Uploads are decoded once, cropped to a small square thumbnail and stored under
+a name derived from the uploaded bytes, so the same picture uploaded twice (or
+by two users) is processed and stored once, and users can no longer overwrite
+each other's files by picking the same filename. Because a name never changes
+content, the files can be served with immutable, year-long cache headers.
+
+Decoding and resizing are CPU-bound, so they run on eventlet's native thread
+pool instead of the hub.
+"""
+import hashlib
+import io
+import os
+import re
+
+from eventlet import tpool
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Refuse images that would decode to more than this many pixels
+Image.MAX_IMAGE_PIXELS = 4096 * 4096
+
+NAME_RE = re.compile(r'^[0-9a-f]{24}\.(png|webp)$')
+
+
+class InvalidAvatar(ValueError):
+    pass
+
+
+class AvatarStore:
+    def __init__(self, directory, size=128, webp=False):
+        self.directory = directory
+        self.size = size
+        self.format = 'webp' if webp else 'png'
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def name_for(self, data):
+        # The thumbnail settings are part of the key so changing them re-renders
+        digest = hashlib.sha256(data)
+        digest.update(f"{self.size}:{self.format}".encode())
+        return f"{digest.hexdigest()[:24]}.{self.format}"
+
+    def save(self, data):
+        """Store a thumbnail of the uploaded image bytes and return its filename.
+
+        Raises InvalidAvatar if the bytes are not a decodable image.
+        """
+        name = self.name_for(data)
+        path = self.path(name)
+        if os.path.exists(path):
+            return name
+        thumbnail = tpool.execute(self._render, data)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(thumbnail)
+        os.replace(tmp_path, path)
+        return name
+
+    def _render(self, data):
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.draft('RGB', (self.size * 2, self.size * 2))
+                image = ImageOps.exif_transpose(image)
+                image = image.convert('RGBA')
+                image = ImageOps.fit(image, (self.size, self.size), Image.LANCZOS)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+            raise InvalidAvatar(str(e))
+        out = io.BytesIO()
+        if self.format == 'webp':
+            image.save(out, 'WEBP', quality=85, method=4)
+        else:
+            image.save(out, 'PNG', optimize=True)
+        return out.getvalue()
+
+
+def is_thumbnail_name(avatar):
+    return bool(avatar) and NAME_RE.match(avatar) is not None
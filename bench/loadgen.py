@@ -0,0 +1,337 @@
+"""
+Headless load generator for the Socket.IO game loop.
+
+Each simulated player logs in over HTTP, joins the lobby, and (per room) one
+leader starts a game. Then every player joins the room and sends random legal
+moves; at the end one player per room walks the shortest path to the goal.
+
+    python bench/loadgen.py --rooms 250 --players-per-room 4 --duration 30
+    python bench/loadgen.py --url http://127.0.0.1:8080 --no-spawn ...
+
+Without --no-spawn, bench/server.py is started (mongomock unless --mongo-uri).
+Results are written as JSON (default bench/results/<timestamp>.json) so runs
+can be compared over time.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter, deque
+
+import aiohttp
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from broadcast import MOVE_RECORD, MOVE_REQUEST  # noqa: E402
+from maze import get_maze  # noqa: E402
+
+BENCH_PASSWORD = 'bench-password'
+DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+
+class Stats:
+    def __init__(self):
+        self.events = Counter()
+        self.moves_sent = 0
+        self.latencies = []
+        # (username, row, col) -> send time of the latest move to that cell
+        self.in_flight = {}
+        self.errors = Counter()
+        self.wins = 0
+
+    def moved(self, username, row, col):
+        sent = self.in_flight.pop((username, row, col), None)
+        if sent is not None:
+            self.latencies.append(time.perf_counter() - sent)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def shortest_path(maze, start, goal):
+    prev = {start: None}
+    queue = deque([start])
+    while queue:
+        cell = queue.popleft()
+        if cell == goal:
+            break
+        for dr, dc in DIRECTIONS:
+            nxt = (cell[0] + dr, cell[1] + dc)
+            if nxt not in prev and not maze.is_wall(*nxt):
+                prev[nxt] = cell
+                queue.append(nxt)
+    path = []
+    cell = goal
+    while cell is not None:
+        path.append(cell)
+        cell = prev.get(cell)
+    return path[::-1][1:]
+
+
+class Player:
+    def __init__(self, base_url, username, stats, protocol='json'):
+        self.base_url = base_url
+        self.username = username
+        self.stats = stats
+        self.protocol = protocol
+        # player id -> username, for binary `moved` frames
+        self.names = {}
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.in_lobby = asyncio.get_event_loop().create_future()
+        self.game_start = asyncio.get_event_loop().create_future()
+        self.joined = asyncio.get_event_loop().create_future()
+        self.expected_room = None
+        self.row, self.col = 1, 1
+        self._register_handlers()
+
+    def _register_handlers(self):
+        sio, stats = self.sio, self.stats
+
+        @sio.on('*')
+        async def any_event(event, *args):
+            stats.events[event] += 1
+
+        @sio.on('lobby_snapshot')
+        async def on_lobby_snapshot(data):
+            stats.events['lobby_snapshot'] += 1
+            if not self.in_lobby.done():
+                self.in_lobby.set_result(data)
+
+        @sio.on('game_start')
+        async def on_game_start(data):
+            stats.events['game_start'] += 1
+            if data.get('room') == self.expected_room and not self.game_start.done():
+                self.game_start.set_result(data)
+
+        @sio.on('join_game_ack')
+        async def on_join_ack(data):
+            stats.events['join_game_ack'] += 1
+            self.protocol = data.get('protocol', 'json')
+            self.names.update((p['id'], p['username']) for p in data['players'])
+            if not self.joined.done():
+                self.joined.set_result(data)
+
+        @sio.on('player_joined')
+        async def on_joined(data):
+            stats.events['player_joined'] += 1
+            self.names[data['id']] = data['username']
+
+        @sio.on('moved')
+        async def on_binary_moved(data):
+            stats.events['moved'] += 1
+            for player_id, row, col in MOVE_RECORD.iter_unpack(data):
+                if player_id in self.names:
+                    stats.moved(self.names[player_id], row, col)
+
+        @sio.on('player_moved')
+        async def on_moved(data):
+            stats.events['player_moved'] += 1
+            stats.moved(data['username'], data['row'], data['col'])
+
+        @sio.on('players_moved')
+        async def on_batch(data):
+            stats.events['players_moved'] += 1
+            for m in data['moves']:
+                stats.moved(m['username'], m['row'], m['col'])
+
+        @sio.on('move_rejected')
+        async def on_rejected(data):
+            stats.events['move_rejected'] += 1
+            self.row, self.col = data['row'], data['col']
+
+        @sio.on('player_won')
+        async def on_won(data):
+            stats.events['player_won'] += 1
+            if data['winner'] == self.username:
+                stats.wins += 1
+
+    async def connect(self, session):
+        async with session.post(f"{self.base_url}/login", allow_redirects=False,
+                                data={'username': self.username, 'password': BENCH_PASSWORD}) as resp:
+            if resp.status != 302:
+                raise RuntimeError(f"login failed for {self.username}: HTTP {resp.status}")
+            cookie = resp.cookies.get('session')
+        await self.sio.connect(self.base_url, transports=['websocket'],
+                               headers={'Cookie': f"session={cookie.value}"})
+
+    async def send_move(self, room, row, col):
+        self.stats.in_flight[(self.username, row, col)] = time.perf_counter()
+        self.stats.moves_sent += 1
+        self.row, self.col = row, col
+        if self.protocol == 'binary':
+            await self.sio.emit('mv', MOVE_REQUEST.pack(row, col))
+        else:
+            await self.sio.emit('move', {'room': room, 'username': self.username, 'row': row, 'col': col})
+
+
+async def run_room(base_url, session, index, args, stats, deadline):
+    players = [Player(base_url, f"bench_{index * args.players_per_room + i}", stats, args.protocol)
+               for i in range(args.players_per_room)]
+    try:
+        for p in players:
+            await p.connect(session)
+            await p.sio.emit('join_lobby')
+        await asyncio.wait_for(asyncio.gather(*(p.in_lobby for p in players)), 30)
+
+        # A private game: game_start only goes to the host, the others join the known room id
+        room = str(uuid.uuid4())
+        host = players[0]
+        host.expected_room = room
+        await host.sio.emit('start_game', {'room': room, 'size': args.maze_size})
+        start = await asyncio.wait_for(host.game_start, 30)
+        maze = get_maze(start['seed'], start['rows'], start['cols'])
+        goal = tuple(start['goal'])
+
+        for p in players:
+            await p.sio.emit('join_room', {'room': room, 'username': p.username, 'protocol': p.protocol})
+        await asyncio.wait_for(asyncio.gather(*(p.joined for p in players)), 30)
+
+        async def wander(p):
+            interval = 1.0 / args.move_rate
+            while time.monotonic() < deadline:
+                await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+                options = [(p.row + dr, p.col + dc) for dr, dc in DIRECTIONS
+                           if not maze.is_wall(p.row + dr, p.col + dc)
+                           and (p.row + dr, p.col + dc) != goal]
+                if options:
+                    await p.send_move(room, *random.choice(options))
+
+        await asyncio.gather(*(wander(p) for p in players))
+
+        winner = players[0]
+        for row, col in shortest_path(maze, (winner.row, winner.col), goal):
+            await winner.send_move(room, row, col)
+            # Stay under the default 15 moves/s socket budget
+            await asyncio.sleep(1 / 12)
+        await asyncio.sleep(1.0)
+    except Exception as e:
+        stats.errors[type(e).__name__] += 1
+    finally:
+        for p in players:
+            if p.sio.connected:
+                await p.sio.disconnect()
+
+
+async def fetch_stats(session, base_url):
+    async with session.get(f"{base_url}/bench/stats") as resp:
+        return await resp.json()
+
+
+async def run(args):
+    stats = Stats()
+    connector = aiohttp.TCPConnector(limit=256)
+    async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar()) as session:
+        before = await fetch_stats(session, args.url)
+        started = time.monotonic()
+        deadline = started + args.ramp + args.duration
+
+        tasks = []
+        for i in range(args.rooms):
+            tasks.append(asyncio.ensure_future(run_room(args.url, session, i, args, stats, deadline)))
+            await asyncio.sleep(args.ramp / max(args.rooms, 1))
+        await asyncio.gather(*tasks)
+
+        elapsed = time.monotonic() - started
+        after = await fetch_stats(session, args.url)
+
+    players = args.rooms * args.players_per_room
+    cpu = (after['cpu_user'] + after['cpu_system']) - (before['cpu_user'] + before['cpu_system'])
+    mongo_ops = {k: after['mongo_ops'].get(k, 0) - before['mongo_ops'].get(k, 0) for k in after['mongo_ops']}
+    received = sum(stats.events.values())
+
+    def ms(v):
+        return None if v is None else round(v * 1000, 3)
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': vars(args),
+        'players': players,
+        'elapsed_s': round(elapsed, 3),
+        'moves_sent': stats.moves_sent,
+        'moves_sent_per_s': round(stats.moves_sent / elapsed, 1),
+        'events_received': dict(stats.events),
+        'events_received_per_s': round(received / elapsed, 1),
+        'move_to_broadcast_latency_ms': {
+            'samples': len(stats.latencies),
+            'p50': ms(percentile(stats.latencies, 50)),
+            'p95': ms(percentile(stats.latencies, 95)),
+            'p99': ms(percentile(stats.latencies, 99)),
+        },
+        'wins': stats.wins,
+        'errors': dict(stats.errors),
+        'server': {
+            'cpu_s': round(cpu, 3),
+            'cpu_ms_per_player': round(cpu * 1000 / players, 3) if players else None,
+            'rss_bytes': after['rss_bytes'],
+            'rss_delta_bytes_per_player': round((after['rss_bytes'] - before['rss_bytes']) / players)
+            if players else None,
+        },
+        'mongo_ops': mongo_ops,
+        'mongo_ops_total': sum(mongo_ops.values()),
+    }
+
+
+def spawn_server(args):
+    port = args.url.rsplit(':', 1)[1].rstrip('/')
+    cmd = [sys.executable, os.path.join(ROOT, 'bench', 'server.py'), '--port', port,
+           '--users', str(args.rooms * args.players_per_room)]
+    if args.mongo_uri:
+        cmd += ['--mongo-uri', args.mongo_uri]
+    env = dict(os.environ, MOVE_BROADCAST_MODE=args.broadcast_mode,
+               BINARY_MOVES='true' if args.protocol == 'binary' else 'false')
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, env=env, text=True)
+    for line in proc.stdout:
+        if 'bench server ready' in line:
+            break
+    else:
+        raise RuntimeError('bench server exited before becoming ready')
+    time.sleep(0.5)
+    return proc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8090')
+    parser.add_argument('--no-spawn', action='store_true', help='target an already running server')
+    parser.add_argument('--mongo-uri', help='passed to the spawned bench server')
+    parser.add_argument('--broadcast-mode', default='immediate', choices=['immediate', 'tick'])
+    parser.add_argument('--protocol', default='json', choices=['json', 'binary'], help='move wire format')
+    parser.add_argument('--maze-size', default='classic', help='maze preset passed to start_game')
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--players-per-room', type=int, default=4)
+    parser.add_argument('--move-rate', type=float, default=5.0, help='moves per second per player')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of random movement')
+    parser.add_argument('--ramp', type=float, default=5.0, help='seconds over which rooms are started')
+    parser.add_argument('--out', help='result file (default bench/results/<timestamp>.json)')
+    args = parser.parse_args()
+
+    proc = None if args.no_spawn else spawn_server(args)
+    try:
+        result = asyncio.get_event_loop().run_until_complete(run(args))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    out = args.out or os.path.join(ROOT, 'bench', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+    print(f"results written to {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Benchmark server: runs app.py against a local Mongo stand-in and exposes
+process/Mongo counters on /bench/stats for bench/loadgen.py.
+
+    python bench/server.py --port 8090 --users 2000              # mongomock
+    python bench/server.py --mongo-uri mongodb://localhost:27017/mmo_bench
+
+Every collection is wrapped in a counting proxy, so the reported Mongo op counts
+are the calls the app makes (a bulk_write counts as one op).
+"""
+import eventlet
+eventlet.monkey_patch()
+import argparse
+import os
+import resource
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_PASSWORD = 'bench-password'
+
+
+class CountingCollection:
+    def __init__(self, collection, counts):
+        self._collection = collection
+        self._counts = counts
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+        counts = self._counts
+        key = f"{self._collection.name}.{name}"
+
+        def counted(*args, **kwargs):
+            counts[key] += 1
+            if name == 'bulk_write' and _is_mongomock(self._collection):
+                return _mongomock_bulk_write(self._collection, *args)
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingDatabase:
+    def __init__(self, db):
+        self._db = db
+        self._collections = {}
+        self.counts = Counter()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name not in self._collections:
+            self._collections[name] = CountingCollection(self._db[name], self.counts)
+        return self._collections[name]
+
+    def __getitem__(self, name):
+        return self.__getattr__(name)
+
+
+def _is_mongomock(collection):
+    return type(collection).__module__.startswith('mongomock')
+
+
+def _mongomock_bulk_write(collection, requests, *args):
+    # Older mongomock releases cannot consume pymongo>=4.9 request objects;
+    # replaying them one by one keeps the app's semantics for benchmarking.
+    from pymongo import UpdateOne, UpdateMany, ReplaceOne, InsertOne, DeleteOne, DeleteMany
+    from pymongo.results import BulkWriteResult
+    counts = Counter()
+    for op in requests:
+        if isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+            if isinstance(op, UpdateOne):
+                result = collection.update_one(op._filter, op._doc, upsert=op._upsert)
+            elif isinstance(op, UpdateMany):
+                result = collection.update_many(op._filter, op._doc, upsert=op._upsert)
+            else:
+                result = collection.replace_one(op._filter, op._doc, upsert=op._upsert)
+            counts['nMatched'] += result.matched_count
+            counts['nModified'] += result.modified_count
+            counts['nUpserted'] += 1 if result.upserted_id is not None else 0
+        elif isinstance(op, InsertOne):
+            collection.insert_one(op._doc)
+            counts['nInserted'] += 1
+        elif isinstance(op, DeleteOne):
+            counts['nRemoved'] += collection.delete_one(op._filter).deleted_count
+        elif isinstance(op, DeleteMany):
+            counts['nRemoved'] += collection.delete_many(op._filter).deleted_count
+    # The app reads modified_count and friends off the result, like with a real server
+    return BulkWriteResult({'nInserted': counts['nInserted'], 'nUpserted': counts['nUpserted'],
+                            'nMatched': counts['nMatched'], 'nModified': counts['nModified'],
+                            'nRemoved': counts['nRemoved'], 'upserted': []}, True)
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is the peak, in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--users', type=int, default=1000, help='bench users to create')
+    parser.add_argument('--mongo-uri', help='use a local mongod instead of mongomock')
+    args = parser.parse_args()
+
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('HTTP_LOG_SAMPLE_RATE', '0')
+    # Cheap hashes so that seeding and logging in thousands of users does not dominate the run
+    os.environ.setdefault('BCRYPT_ROUNDS', '4')
+    if args.mongo_uri:
+        os.environ['MONGODB_URI'] = args.mongo_uri
+        os.environ.setdefault('MONGO_TLS', 'false')
+    else:
+        os.environ.setdefault('MONGODB_URI', 'mongodb://localhost:27017/mmo_bench')
+    os.chdir(ROOT)
+
+    import bcrypt
+    import app as game_app
+
+    if args.mongo_uri:
+        real_db = game_app.mongo.db
+    else:
+        import mongomock
+        real_db = mongomock.MongoClient().db
+    db = CountingDatabase(real_db)
+    game_app.mongo.db = db
+
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode('utf-8'),
+                                  bcrypt.gensalt(game_app.password_hasher.rounds))
+    real_db.users.delete_many({'username': {'$regex': '^bench_'}})
+    real_db.users.insert_many([{
+        'username': f'bench_{i}', 'password': password_hash,
+        'won': 0, 'lose': 0, 'played': 0, 'exp': 0, 'level': 1
+    } for i in range(args.users)])
+    db.counts.clear()
+
+    @game_app.app.route('/bench/stats')
+    def bench_stats():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return game_app.jsonify({
+            'time': time.time(),
+            'cpu_user': usage.ru_utime,
+            'cpu_system': usage.ru_stime,
+            'rss_bytes': _rss_bytes(),
+            'mongo_ops': dict(db.counts),
+        })
+
+    print(f"bench server ready on {args.host}:{args.port}", flush=True)
+    game_app.socketio.run(game_app.app, host=args.host, port=args.port, log_output=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Fan-out of player movement to the rest of a game room.
+
+In "immediate" mode every accepted move is forwarded as its own
+`player_moved` frame, exactly like the original handler. In "tick" mode the
+latest position of each player who moved is buffered per room and a single
+batched `players_moved` frame is sent every tick, so the outbound frame rate
+of a room is capped at the tick rate no matter how fast clients send moves.
+
+Clients pick a wire format when they join a room and are put in a matching
+sub-room (see protocol_room). JSON clients get the events above; binary
+clients get `moved` frames made of packed (player id, row, col) records
+instead of JSON objects repeating usernames, in both modes.
+
+With a view radius set, rooms are interest-managed: a move only goes to the
+players within that many cells of the mover (looked up in a per-room
+SpatialGrid), and every snapshot interval the whole room gets everyone's
+position so far-away players stay roughly right. The grid lives in this
+process, so it only sees the players of the worker it runs on.
+"""
+import logging
+import struct
+
+from interest import SpatialGrid
+
+logger = logging.getLogger('mmo_game')
+
+MODE_IMMEDIATE = 'immediate'
+MODE_TICK = 'tick'
+
+# Stop a room's tick loop after this many empty ticks; it restarts on the next move
+IDLE_TICKS_BEFORE_STOP = 100
+
+PROTOCOL_JSON = 'json'
+PROTOCOL_BINARY = 'binary'
+
+# Outbound `moved` record: player id, row, col (little-endian uint16s)
+MOVE_RECORD = struct.Struct('<HHH')
+# Inbound `mv` frame: row, col
+MOVE_REQUEST = struct.Struct('<HH')
+
+
+def protocol_room(room, protocol):
+    """Socket.IO room holding the sockets of a game room that use one wire format."""
+    return f"{room}:{protocol}"
+
+
+def unpack_move_request(data):
+    """(row, col) from a binary `mv` frame, or None if it is malformed."""
+    if not isinstance(data, (bytes, bytearray)) or len(data) != MOVE_REQUEST.size:
+        return None
+    return MOVE_REQUEST.unpack(data)
+
+
+def _json_moves(moves, seq=None):
+    batch = {'moves': [{'username': u, 'row': r, 'col': c} for u, _, r, c in moves]}
+    if seq is not None:
+        batch['seq'] = seq
+    return batch
+
+
+def _packed_moves(moves):
+    return b''.join(MOVE_RECORD.pack(i, r, c) for _, i, r, c in moves if i is not None)
+
+
+class MoveBroadcaster:
+    def __init__(self, socketio, mode=MODE_IMMEDIATE, tick_rate=20, view_radius=None, snapshot_interval=2.0):
+        if mode not in (MODE_IMMEDIATE, MODE_TICK):
+            raise ValueError(f"Unknown move broadcast mode '{mode}'")
+        self.socketio = socketio
+        self.mode = mode
+        self.tick_rate = tick_rate
+        self.view_radius = view_radius
+        self.snapshot_interval = snapshot_interval
+        # room -> {username: (player id, row, col)} moves waiting for the next tick,
+        # and the room event seq of the latest of them (see room_events)
+        self._pending = {}
+        self._pending_seq = {}
+        # rooms that currently have a tick loop running
+        self._loops = set()
+        # room -> SpatialGrid, only when interest management is on
+        self._grids = {}
+
+    def track(self, room, username, row, col, sid, protocol, player_id):
+        """Register a player's socket and position for interest management."""
+        if not self.view_radius:
+            return
+        grid = self._grids.get(room)
+        if grid is None:
+            grid = self._grids[room] = SpatialGrid(self.view_radius)
+            self.socketio.start_background_task(self._snapshot_loop, room, grid)
+        grid.add(username, row, col, sid, protocol, player_id)
+
+    def untrack(self, room, username):
+        grid = self._grids.get(room)
+        if grid is not None:
+            grid.remove(username)
+            if not grid:
+                del self._grids[room]
+
+    def publish(self, room, username, row, col, sid=None, player_id=None, seq=None):
+        """Send (or queue) a player's new position to everyone else in the room.
+
+        JSON frames carry the move's room event seq, if given; binary frames stay bare.
+        """
+        grid = self._grids.get(room)
+        if grid is not None:
+            grid.move(username, row, col)
+
+        if self.mode == MODE_IMMEDIATE:
+            if grid is not None:
+                self._send_nearby(grid, [(username, player_id, row, col)], 'player_moved', seq)
+                return
+            self.socketio.emit('player_moved', {
+                'username': username,
+                'row': row,
+                'col': col,
+                'seq': seq
+            }, room=protocol_room(room, PROTOCOL_JSON), skip_sid=sid)
+            if player_id is not None:
+                self.socketio.emit('moved', MOVE_RECORD.pack(player_id, row, col),
+                                   room=protocol_room(room, PROTOCOL_BINARY), skip_sid=sid)
+            return
+
+        self._pending.setdefault(room, {})[username] = (player_id, row, col)
+        if seq is not None:
+            self._pending_seq[room] = seq
+        if room not in self._loops:
+            self._loops.add(room)
+            self.socketio.start_background_task(self._run, room)
+
+    def flush(self, room):
+        """Immediately send whatever is buffered for a room (e.g. before game over)."""
+        moves = self._pending.pop(room, None)
+        seq = self._pending_seq.pop(room, None)
+        if not moves:
+            return
+        moves = [(u, i, r, c) for u, (i, r, c) in moves.items()]
+        grid = self._grids.get(room)
+        if grid is not None:
+            self._send_nearby(grid, moves, 'players_moved', seq)
+            return
+        self._send_all(room, moves, seq)
+
+    def _send_all(self, room, moves, seq=None):
+        self.socketio.emit('players_moved', _json_moves(moves, seq), room=protocol_room(room, PROTOCOL_JSON))
+        packed = _packed_moves(moves)
+        if packed:
+            self.socketio.emit('moved', packed, room=protocol_room(room, PROTOCOL_BINARY))
+
+    def _send_nearby(self, grid, moves, json_event, seq=None):
+        """Send each move only to the other players who can see it.
+
+        One cell of slack past the view radius lets players that the mover just
+        walked away from see it leave instead of freezing at the edge.
+        """
+        radius = self.view_radius + 1
+        if len(moves) == 1:
+            username, player_id, row, col = moves[0]
+            json_sids, binary_sids = [], []
+            for viewer in grid.nearby(row, col, radius):
+                if viewer != username:
+                    entry = grid.players[viewer]
+                    (binary_sids if entry[3] == PROTOCOL_BINARY else json_sids).append(entry[2])
+            if json_sids:
+                payload = {'username': username, 'row': row, 'col': col, 'seq': seq} \
+                    if json_event == 'player_moved' else _json_moves(moves, seq)
+                self.socketio.emit(json_event, payload, to=json_sids)
+            if binary_sids and player_id is not None:
+                self.socketio.emit('moved', MOVE_RECORD.pack(player_id, row, col), to=binary_sids)
+            return
+
+        # Several movers (a tick batch): each viewer gets its own subset
+        visible = {}
+        for move in moves:
+            for viewer in grid.nearby(move[2], move[3], radius):
+                if viewer != move[0]:
+                    visible.setdefault(viewer, []).append(move)
+        for viewer, seen in visible.items():
+            entry = grid.players[viewer]
+            if entry[3] == PROTOCOL_BINARY:
+                packed = _packed_moves(seen)
+                if packed:
+                    self.socketio.emit('moved', packed, to=entry[2])
+            else:
+                self.socketio.emit('players_moved', _json_moves(seen, seq), to=entry[2])
+
+    def _snapshot_loop(self, room, grid):
+        """Periodically send every position to the whole room while it has tracked players."""
+        try:
+            while True:
+                self.socketio.sleep(self.snapshot_interval)
+                if self._grids.get(room) is not grid:
+                    return
+                self._send_all(room, [(u, e[4], e[0], e[1]) for u, e in grid.players.items()])
+        except Exception as e:
+            logger.error(f"Broadcast: snapshot loop for room '{room}' crashed: {str(e)}")
+
+    def discard(self, room):
+        """Forget buffered moves and the spatial grid of a room that was won or emptied.
+
+        Its tick and snapshot loops stop on their next wake-up.
+        """
+        self._pending.pop(room, None)
+        self._pending_seq.pop(room, None)
+        self._grids.pop(room, None)
+
+    def _run(self, room):
+        interval = 1.0 / self.tick_rate
+        idle = 0
+        try:
+            while idle < IDLE_TICKS_BEFORE_STOP:
+                self.socketio.sleep(interval)
+                if room in self._pending:
+                    self.flush(room)
+                    idle = 0
+                else:
+                    idle += 1
+        except Exception as e:
+            logger.error(f"Broadcast: tick loop for room '{room}' crashed: {str(e)}")
+        finally:
+            self._loops.discard(room)
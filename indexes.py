@@ -0,0 +1,144 @@
+"""
+Declarative MongoDB indexes and a query-shape audit.
+
+INDEXES lists every index the app relies on; ensure_indexes() creates any
+that are missing (it runs in the background at startup, and is idempotent).
+QUERY_SHAPES mirrors the queries the app issues; audit() runs each through
+explain() and reports the ones whose winning plan is a collection scan.
+
+    python indexes.py                  # ensure indexes on MONGODB_URI
+    python indexes.py --audit          # ensure, then exit 1 if any query shape does a COLLSCAN
+    python indexes.py --audit --uri mongodb://localhost:27017/mmo_game
+"""
+import argparse
+import logging
+import os
+import sys
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from leaderboard import ENTRY_PROJECTION, RANKINGS
+
+logger = logging.getLogger('mmo_game')
+
+INDEXES = {
+    'users': [
+        IndexModel([('username', ASCENDING)], unique=True, name='username_unique'),
+        # Leaderboard rankings, each ending in username so ties are ordered by the index
+        *(IndexModel(ranking.sort, name=f"rank_{ranking.name}") for ranking in RANKINGS.values()),
+    ],
+    'ingame': [
+        IndexModel([('room', ASCENDING)], unique=True, name='room_unique'),
+        # Sessions expire at expires_at (see ingame_sync)
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0, name='expires_at_ttl'),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Create missing indexes; returns False if any collection failed."""
+    ok = True
+    for collection, models in INDEXES.items():
+        try:
+            db[collection].create_indexes(models)
+        except PyMongoError as e:
+            # e.g. duplicate usernames from before the unique index existed
+            logger.error(f"Indexes: Failed to create indexes on '{collection}': {str(e)}")
+            ok = False
+    return ok
+
+
+def _find(collection, query, projection=None, sort=None, limit=0):
+    def explain(db):
+        cursor = db[collection].find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        return cursor.limit(limit).explain()
+    return explain
+
+
+def _update(collection, query, update, upsert=False, multi=False):
+    def explain(db):
+        return db.command('explain', {'update': collection,
+                                      'updates': [{'q': query, 'u': update, 'upsert': upsert, 'multi': multi}]},
+                          verbosity='queryPlanner')
+    return explain
+
+
+# (description, explain(db)) for every query shape in the app, with sample values
+QUERY_SHAPES = [
+    ('users: load_user by _id', _find('users', {'_id': ObjectId()}, {'password': 0, 'created_at': 0})),
+    ('users: register/login/records/userinfo by username', _find('users', {'username': 'sample'})),
+    ('users: rehash password by _id', _update('users', {'_id': ObjectId()}, {'$set': {'password': b''}})),
+    ('users: avatar upload by _id', _update('users', {'_id': ObjectId()}, {'$set': {'avatar': 'sample'}})),
+    ('users: settlement by username', _update('users', {'username': 'sample'}, [{'$set': {'played': 1}}])),
+    ('users: win_rate backfill',
+     _update('users', {'played': {'$gt': 0}, 'win_rate': {'$exists': False}}, [{'$set': {'win_rate': 0}}],
+             multi=True)),
+    ('users: leaderboard refresh by usernames',
+     _find('users', {'username': {'$in': ['a', 'b']}}, ENTRY_PROJECTION)),
+    *((f"users: {ranking.name} ranking", _find('users', ranking.query, ENTRY_PROJECTION, ranking.sort, 50))
+      for ranking in RANKINGS.values()),
+    ('leaderboards: materialize by _id', _update('leaderboards', {'_id': 'wins'}, {'_id': 'wins'}, upsert=True)),
+    ('ingame: session upsert by room',
+     _update('ingame', {'room': 'sample'}, {'$set': {'players': []}}, upsert=True)),
+    ('ingame: expire legacy sessions',
+     _update('ingame', {'expires_at': {'$exists': False}}, {'$set': {'x': 1}}, multi=True)),
+]
+
+
+def _stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+def audit(db):
+    """[(description, problem)] for every query shape that scans a collection or cannot be explained."""
+    problems = []
+    for description, explain in QUERY_SHAPES:
+        try:
+            result = explain(db)
+        except (OperationFailure, NotImplementedError) as e:
+            problems.append((description, f"explain failed: {e}"))
+            continue
+        if 'COLLSCAN' in _stages(result.get('queryPlanner', {}).get('winningPlan', {})):
+            problems.append((description, 'COLLSCAN'))
+    return problems
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default=os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/mmo_game'))
+    parser.add_argument('--audit', action='store_true', help='fail if any query shape does a collection scan')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    tls = os.environ.get('MONGO_TLS', 'true').lower() == 'true' and not args.uri.startswith('mongodb://localhost')
+    client = MongoClient(args.uri, tls=tls)
+    db = client.get_default_database('mmo_game')
+
+    ok = ensure_indexes(db)
+    print(f"indexes {'ensured' if ok else 'FAILED'} on {db.name}")
+    if args.audit:
+        problems = audit(db)
+        for description, problem in problems:
+            print(f"  {problem}: {description}")
+        print(f"audited {len(QUERY_SHAPES)} query shapes, {len(problems)} problem(s)")
+        ok = ok and not problems
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Write-behind mirror of live game sessions into the `ingame` collection.
+
+The room-state backend is the source of truth for which games exist and who
+is in them; nothing reads `ingame` on the request path. Socket handlers only
+mark a room dirty, and a background greenlet periodically writes the current
+snapshot of every dirty room (config, players, winner) as one unordered
+bulk_write of upserts. Starting or joining a game therefore costs no Mongo
+round trip, and a burst of joins/leaves in a room collapses into one write.
+
+Each write pushes `expires_at` forward; a TTL index on it lets Mongo drop
+finished and abandoned sessions on its own instead of the old
+delete_many({"players": []}) scan on every game start.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger('mmo_game')
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+class IngameWriteBehind:
+    def __init__(self, socketio, mongo, room_state, delay=1.0, ttl=6 * 60 * 60, finished_ttl=60 * 60):
+        self.socketio = socketio
+        self.mongo = mongo
+        self.room_state = room_state
+        self.delay = delay
+        self.ttl = timedelta(seconds=ttl)
+        self.finished_ttl = timedelta(seconds=finished_ttl)
+        # room -> winner (None until the game is won) for rooms with unsaved changes
+        self._dirty = {}
+        self._scheduled = False
+        self.writes = 0
+        self.failures = 0
+
+    def expire_legacy(self):
+        """Give sessions written before the TTL index (see indexes.py) an expiry, or they live forever."""
+        try:
+            self.mongo.db.ingame.update_many({'expires_at': {'$exists': False}},
+                                             {'$set': {'expires_at': _utcnow() + self.finished_ttl}})
+        except PyMongoError as e:
+            logger.error(f"Game: Failed to expire legacy ingame sessions: {str(e)}")
+
+    def pending(self):
+        return len(self._dirty)
+
+    def touch(self, room):
+        """Note that a room's players or config changed."""
+        self._dirty.setdefault(room, None)
+        self._schedule()
+
+    def finish(self, room, winner):
+        self._dirty[room] = winner
+        self._schedule()
+
+    def _schedule(self):
+        if not self._scheduled:
+            self._scheduled = True
+            self.socketio.start_background_task(self._flush_later)
+
+    def _flush_later(self):
+        self.socketio.sleep(self.delay)
+        self._scheduled = False
+        self.flush()
+
+    def flush(self):
+        dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        now = _utcnow()
+        ops = []
+        for room, winner in dirty.items():
+            config = self.room_state.get_room(room)
+            if config is None:
+                continue
+            fields = {
+                'seed': config['seed'],
+                'rows': config['rows'],
+                'cols': config['cols'],
+                'players': self.room_state.player_names(room),
+                'updated_at': now,
+                'expires_at': now + (self.finished_ttl if config['settled'] else self.ttl),
+            }
+            if winner is not None:
+                fields['winner'] = winner
+                fields['ended_at'] = now
+            ops.append(UpdateOne({'room': room}, {'$set': fields, '$setOnInsert': {'started_at': now}},
+                                 upsert=True))
+        if not ops:
+            return
+        try:
+            self.mongo.db.ingame.bulk_write(ops, ordered=False)
+            self.writes += len(ops)
+        except PyMongoError as e:
+            self.failures += 1
+            logger.error(f"Game: Failed to save {len(ops)} ingame session(s), will retry: {str(e)}")
+            # Snapshots are idempotent, so retrying later is safe; newer changes win
+            for room, winner in dirty.items():
+                if self._dirty.get(room) is None:
+                    self._dirty[room] = winner
+            self._schedule()
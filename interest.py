@@ -0,0 +1,64 @@
+"""
+Spatial hash of the players in one game room, for interest management.
+
+Players are bucketed into square blocks of maze cells so "who can see
+(row, col)" only looks at the handful of buckets around it instead of every
+player in the room. Visibility is a square view radius (Chebyshev distance),
+like a camera centred on each player.
+"""
+
+
+class SpatialGrid:
+    def __init__(self, bucket_size):
+        self.bucket_size = max(1, bucket_size)
+        # username -> [row, col, sid, protocol, player id]
+        self.players = {}
+        # (bucket row, bucket col) -> set of usernames
+        self.buckets = {}
+
+    def _bucket(self, row, col):
+        return row // self.bucket_size, col // self.bucket_size
+
+    def __len__(self):
+        return len(self.players)
+
+    def add(self, username, row, col, sid, protocol, player_id):
+        self.remove(username)
+        self.players[username] = [row, col, sid, protocol, player_id]
+        self.buckets.setdefault(self._bucket(row, col), set()).add(username)
+
+    def remove(self, username):
+        entry = self.players.pop(username, None)
+        if entry is None:
+            return
+        key = self._bucket(entry[0], entry[1])
+        bucket = self.buckets[key]
+        bucket.discard(username)
+        if not bucket:
+            del self.buckets[key]
+
+    def move(self, username, row, col):
+        entry = self.players.get(username)
+        if entry is None:
+            return
+        old_key = self._bucket(entry[0], entry[1])
+        new_key = self._bucket(row, col)
+        entry[0], entry[1] = row, col
+        if old_key != new_key:
+            bucket = self.buckets[old_key]
+            bucket.discard(username)
+            if not bucket:
+                del self.buckets[old_key]
+            self.buckets.setdefault(new_key, set()).add(username)
+
+    def nearby(self, row, col, radius):
+        """Usernames of players within `radius` cells of (row, col)."""
+        span = radius // self.bucket_size + 1
+        center_r, center_c = self._bucket(row, col)
+        players = self.players
+        for br in range(center_r - span, center_r + span + 1):
+            for bc in range(center_c - span, center_c + span + 1):
+                for username in self.buckets.get((br, bc), ()):
+                    entry = players[username]
+                    if abs(entry[0] - row) <= radius and abs(entry[1] - col) <= radius:
+                        yield username
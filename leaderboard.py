@@ -0,0 +1,182 @@
+"""
+Incrementally maintained leaderboards.
+
+Each ranking keeps the top `capacity` users in memory. The set is loaded once
+from an indexed query and then patched from the user documents that game
+settlement touches, so serving /leaderboard never sorts the users collection.
+Optionally every change is mirrored into a small `leaderboards` collection
+so other processes and tools can read the standings without sorting either.
+"""
+import logging
+import time
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger('mmo_game')
+
+# Users need this many games before they appear in the win-rate ranking
+MIN_GAMES_FOR_WIN_RATE = 5
+
+ENTRY_PROJECTION = {'_id': 0, 'username': 1, 'won': 1, 'lose': 1, 'played': 1, 'level': 1, 'exp': 1, 'win_rate': 1}
+
+
+class Ranking:
+    def __init__(self, name, title, sort, score, min_played=0):
+        self.name = name
+        self.title = title
+        # Mongo sort spec, ties broken by username; backed by the rank_<name> index in indexes.py
+        self.sort = sort + [('username', ASCENDING)]
+        # entry -> comparable tuple, higher is better
+        self.score = score
+        self.min_played = min_played
+        self.query = {'played': {'$gte': min_played}} if min_played else {}
+
+    def qualifies(self, entry):
+        return (entry.get('played') or 0) >= self.min_played
+
+
+RANKINGS = {
+    'wins': Ranking('wins', 'Wins', [('won', DESCENDING)],
+                    lambda e: (e.get('won') or 0,)),
+    'level': Ranking('level', 'Level', [('level', DESCENDING), ('exp', DESCENDING)],
+                     lambda e: (e.get('level') or 1, e.get('exp') or 0)),
+    'win_rate': Ranking('win_rate', 'Win rate', [('win_rate', DESCENDING), ('played', DESCENDING)],
+                        lambda e: (e.get('win_rate') or 0.0, e.get('played') or 0),
+                        min_played=MIN_GAMES_FOR_WIN_RATE),
+}
+
+
+class _Board:
+    """Top-`capacity` users of one ranking.
+
+    Invariant: `entries` is exactly the top len(entries) users of the whole
+    collection. Promotions keep it that way; a member whose score drops below
+    the last entry is removed, because an unseen user might now outrank it.
+    """
+
+    def __init__(self, ranking, capacity):
+        self.ranking = ranking
+        self.capacity = capacity
+        self.entries = []
+        # True when every qualifying user is in `entries`
+        self.complete = False
+
+    def _sort_key(self, entry):
+        return tuple(-v for v in self.ranking.score(entry)) + (entry['username'],)
+
+    def load(self, docs):
+        self.entries = sorted(docs, key=self._sort_key)[:self.capacity]
+        self.complete = len(docs) < self.capacity
+
+    def apply(self, doc):
+        """Patch the board with a fresh user document; returns True if it changed."""
+        username = doc['username']
+        rest = [e for e in self.entries if e['username'] != username]
+
+        if self.ranking.qualifies(doc):
+            # Without a complete view, only positions above the last known entry are certain
+            if self.complete or (rest and self._sort_key(doc) <= self._sort_key(rest[-1])):
+                rest.append(doc)
+                rest.sort(key=self._sort_key)
+                if len(rest) > self.capacity:
+                    rest = rest[:self.capacity]
+                    self.complete = False
+
+        changed = rest != self.entries
+        self.entries = rest
+        return changed
+
+
+class Leaderboard:
+    def __init__(self, mongo, size=10, slack=40, materialize=False, refresh_interval=None):
+        self.mongo = mongo
+        self.size = size
+        self.materialize = materialize
+        # With several workers, settlements in other processes are only seen after a reload
+        self.refresh_interval = refresh_interval
+        self._boards = {name: _Board(r, size + slack) for name, r in RANKINGS.items()}
+        self._warm = False
+        self._warmed_at = 0.0
+
+    def backfill(self):
+        """Store win_rate for users who played before it was kept; run once at startup."""
+        try:
+            result = self.mongo.db.users.update_many(
+                {'played': {'$gt': 0}, 'win_rate': {'$exists': False}},
+                [{'$set': {'win_rate': {'$divide': [{'$ifNull': ['$won', 0]}, '$played']}}}]
+            )
+            if result.modified_count:
+                logger.info(f"Leaderboard: backfilled win_rate for {result.modified_count} user(s).")
+        except PyMongoError as e:
+            logger.error(f"Leaderboard: win_rate backfill failed: {str(e)}")
+
+    def warm(self):
+        """(Re)load every ranking from its index; only reads users, so safe to call again at any time."""
+        try:
+            for board in self._boards.values():
+                self._load(board)
+            self._warm = True
+            self._warmed_at = time.monotonic()
+            logger.info("Leaderboard: warmed from indexed queries.")
+        except PyMongoError as e:
+            logger.error(f"Leaderboard: warm-up failed: {str(e)}")
+
+    def _load(self, board):
+        ranking = board.ranking
+        cursor = self.mongo.db.users.find(ranking.query, ENTRY_PROJECTION) \
+            .sort(ranking.sort).limit(board.capacity)
+        board.load(list(cursor))
+        self._materialize(board)
+
+    def top(self, ranking='wins', limit=None):
+        if ranking not in self._boards:
+            raise KeyError(ranking)
+        if not self._warm or (self.refresh_interval
+                               and time.monotonic() - self._warmed_at > self.refresh_interval):
+            self.warm()
+        limit = max(1, min(limit or self.size, self.size))
+        return [dict(e) for e in self._boards[ranking].entries[:limit]]
+
+    def update(self, docs):
+        """Apply changed user documents (e.g. after settlement) to every ranking."""
+        if not self._warm:
+            return
+        for board in self._boards.values():
+            changed = False
+            for doc in docs:
+                changed = board.apply(doc) or changed
+            if len(board.entries) < self.size and not board.complete:
+                # Demotions ate into the displayed range; reload from the index
+                try:
+                    self._load(board)
+                except PyMongoError as e:
+                    logger.error(f"Leaderboard: reload of '{board.ranking.name}' failed: {str(e)}")
+            elif changed:
+                self._materialize(board)
+
+    def refresh_usernames(self, usernames):
+        """Fetch the current documents of some users and apply them."""
+        if not self._warm:
+            return
+        try:
+            docs = list(self.mongo.db.users.find({'username': {'$in': list(usernames)}}, ENTRY_PROJECTION))
+        except PyMongoError as e:
+            logger.error(f"Leaderboard: failed to refresh {len(usernames)} user(s): {str(e)}")
+            return
+        self.update(docs)
+
+    def _materialize(self, board):
+        if not self.materialize:
+            return
+        try:
+            self.mongo.db.leaderboards.replace_one(
+                {'_id': board.ranking.name},
+                {'_id': board.ranking.name,
+                 'entries': board.entries[:self.size],
+                 'updated_at': datetime.now(timezone.utc)},
+                upsert=True
+            )
+        except PyMongoError as e:
+            logger.error(f"Leaderboard: failed to materialize '{board.ranking.name}': {str(e)}")
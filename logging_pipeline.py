@@ -0,0 +1,112 @@
+"""
+Asynchronous log pipeline.
+
+Request handlers only put LogRecords on a bounded queue; a native (non-green)
+writer thread formats them and writes them to size-rotated files. Formatting
+(including the JSON dumps of request logs) is deferred to that thread via
+JsonMessage, and if the queue is full the record is dropped and counted rather
+than making the eventlet hub wait for disk.
+"""
+import json
+import logging
+import os
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from eventlet import patcher
+
+# Real OS threads/queues even after eventlet.monkey_patch()
+_threading = patcher.original('threading')
+_queue = patcher.original('queue')
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+HTTP_LOG_FORMAT = '%(asctime)s - %(message)s'
+
+
+class JsonMessage:
+    """Log argument that is only serialized when the writer thread formats it."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: records are dropped when the queue is full."""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the writer thread; the queue never leaves the process
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except _queue.Full:
+            self.dropped += 1
+
+
+class _NativeLockMixin:
+    """Handlers used on the writer thread need real locks, not green ones."""
+
+    def createLock(self):
+        self.lock = _threading.RLock()
+
+
+class _RotatingFileHandler(_NativeLockMixin, RotatingFileHandler):
+    pass
+
+
+class _LoggerNameFilter(logging.Filter):
+    def __init__(self, name, include):
+        super().__init__()
+        self.logger_name = name
+        self.include = include
+
+    def filter(self, record):
+        return (record.name == self.logger_name) == self.include
+
+
+class _NativeQueueListener(QueueListener):
+    def start(self):
+        self._thread = t = _threading.Thread(target=self._monitor, name='log-writer', daemon=True)
+        t.start()
+
+
+class LoggingPipeline:
+    def __init__(self, logs_dir, http_logger_name, max_bytes=10 * 1024 * 1024, backup_count=5,
+                 queue_size=10000):
+        self.queue = _queue.Queue(maxsize=queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+
+        server_handler = _RotatingFileHandler(os.path.join(logs_dir, 'server.log'),
+                                              maxBytes=max_bytes, backupCount=backup_count)
+        server_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        server_handler.addFilter(_LoggerNameFilter(http_logger_name, include=False))
+
+        http_handler = _RotatingFileHandler(os.path.join(logs_dir, 'http_raw.log'),
+                                            maxBytes=max_bytes, backupCount=backup_count)
+        http_handler.setFormatter(logging.Formatter(HTTP_LOG_FORMAT))
+        http_handler.addFilter(_LoggerNameFilter(http_logger_name, include=True))
+
+        self.listener = _NativeQueueListener(self.queue, server_handler, http_handler,
+                                             respect_handler_level=True)
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
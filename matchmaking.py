@@ -0,0 +1,179 @@
+"""
+Lobby matchmaking.
+
+Players ask for a match and wait in a queue per (maze size, level bucket). A
+group starts as soon as its queue holds `capacity` players. Once the oldest
+player in a queue has waited `max_wait` seconds, the group starts with
+whoever is there, topped up from the nearest level buckets of the same maze
+size, provided that makes at least `min_players`. Every group gets its own
+game room and only its own sockets are told about it, so load spreads over
+many small rooms instead of one lobby-wide broadcast.
+
+Each queue is a heap ordered by enqueue time. Cancelling only marks a ticket
+dead; dead tickets are discarded when they reach the top, so joining,
+cancelling and forming a group are all O(log n) per player.
+
+Queues live in the worker that handles the lobby socket; with several
+workers, players are only grouped with others queued on the same worker.
+"""
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger('mmo_game')
+
+
+class _Ticket:
+    __slots__ = ('enqueued', 'seq', 'username', 'sid', 'key', 'active')
+
+    def __init__(self, enqueued, seq, username, sid, key):
+        self.enqueued = enqueued
+        self.seq = seq
+        self.username = username
+        self.sid = sid
+        self.key = key
+        self.active = True
+
+    def __lt__(self, other):
+        return (self.enqueued, self.seq) < (other.enqueued, other.seq)
+
+
+class Matchmaker:
+    def __init__(self, socketio, start_match, capacity=4, min_players=2, max_wait=20.0, level_bucket=0,
+                 interval=1.0, clock=time.monotonic):
+        self.socketio = socketio
+        # start_match(size, [(username, sid), ...]) creates the room and notifies the group
+        self.start_match = start_match
+        self.capacity = max(1, capacity)
+        self.min_players = max(1, min(min_players, self.capacity))
+        self.max_wait = max_wait
+        # Levels per bucket; 0 puts everyone in one bucket per maze size
+        self.level_bucket = level_bucket
+        self.interval = interval
+        self.clock = clock
+        # (size, level bucket) -> heap of tickets, and how many of them are still active
+        self._queues = {}
+        self._counts = {}
+        # username -> active ticket
+        self._tickets = {}
+        self._seq = itertools.count()
+        self._loop_running = False
+        self.matches = 0
+        self.matched_players = 0
+        self.wait_seconds = 0.0
+        # Matches started short-handed because max_wait ran out
+        self.timeouts = 0
+
+    def bucket(self, level):
+        if not self.level_bucket:
+            return 0
+        return max(0, (level or 1) - 1) // self.level_bucket
+
+    def waiting(self):
+        return len(self._tickets)
+
+    def waiting_by_size(self):
+        sizes = {}
+        for (size, _), count in self._counts.items():
+            sizes[size] = sizes.get(size, 0) + count
+        return sizes
+
+    def is_queued(self, username):
+        return username in self._tickets
+
+    def join(self, username, sid, size, level=1):
+        """Queue a player (replacing any earlier ticket); returns how many wait in their queue."""
+        self.leave(username)
+        key = (size, self.bucket(level))
+        ticket = _Ticket(self.clock(), next(self._seq), username, sid, key)
+        heapq.heappush(self._queues.setdefault(key, []), ticket)
+        self._counts[key] = self._counts.get(key, 0) + 1
+        self._tickets[username] = ticket
+        if self._counts[key] >= self.capacity:
+            self._start(self._take(key, self.capacity))
+            return 0
+        self._ensure_loop()
+        return self._counts[key]
+
+    def leave(self, username, sid=None):
+        """Cancel a player's ticket; with a sid, only if it was queued from that socket."""
+        ticket = self._tickets.get(username)
+        if ticket is None or (sid is not None and ticket.sid != sid):
+            return False
+        del self._tickets[username]
+        ticket.active = False
+        self._counts[ticket.key] -= 1
+        self._prune(ticket.key)
+        return True
+
+    def _prune(self, key):
+        """Drop dead tickets off the top of a queue; returns the oldest active one, if any."""
+        heap = self._queues[key]
+        while heap and not heap[0].active:
+            heapq.heappop(heap)
+        if heap:
+            return heap[0]
+        del self._queues[key]
+        del self._counts[key]
+        return None
+
+    def _take(self, key, n):
+        group = []
+        heap = self._queues[key]
+        while heap and len(group) < n:
+            ticket = heapq.heappop(heap)
+            if ticket.active:
+                ticket.active = False
+                del self._tickets[ticket.username]
+                self._counts[key] -= 1
+                group.append(ticket)
+        self._prune(key)
+        return group
+
+    def tick(self):
+        """Start short-handed groups for queues whose oldest player has waited max_wait."""
+        now = self.clock()
+        for key in list(self._queues):
+            if key not in self._queues:
+                continue
+            oldest = self._prune(key)
+            if oldest is None or now - oldest.enqueued < self.max_wait:
+                continue
+            size, bucket = key
+            # Fill up from the nearest level buckets of the same maze size
+            others = sorted((k for k in self._queues if k[0] == size and k != key), key=lambda k: abs(k[1] - bucket))
+            if self._counts[key] + sum(self._counts[k] for k in others) < self.min_players:
+                continue
+            group = self._take(key, self.capacity)
+            for other in others:
+                if len(group) >= self.capacity:
+                    break
+                group += self._take(other, self.capacity - len(group))
+            self.timeouts += 1
+            self._start(group)
+
+    def _start(self, group):
+        now = self.clock()
+        self.matches += 1
+        self.matched_players += len(group)
+        self.wait_seconds += sum(now - ticket.enqueued for ticket in group)
+        try:
+            self.start_match(group[0].key[0], [(ticket.username, ticket.sid) for ticket in group])
+        except Exception as e:
+            logger.error(f"Matchmaking: Failed to start a match for {[t.username for t in group]}: {str(e)}")
+
+    def _ensure_loop(self):
+        if not self._loop_running:
+            self._loop_running = True
+            self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        try:
+            while self._tickets:
+                self.socketio.sleep(self.interval)
+                self.tick()
+        except Exception as e:
+            logger.error(f"Matchmaking: scheduler crashed: {str(e)}")
+        finally:
+            self._loop_running = False
@@ -0,0 +1,315 @@
+"""
+Server-side copy of the maze generator in static/maze.js.
+
+The browser and the server must agree on every wall, so the PRNG and the
+recursive backtracker below are a bit-for-bit port of mulberry32/generateMaze.
+Grids are stored as a packed bitset (1 bit per cell, 1 = wall) and cached per
+(seed, rows, cols); RoomMazes holds the grid of each live room, so validating
+a move is a couple of integer operations.
+
+Large mazes are not generated in the browser at all: clients fetch the
+square chunks around them (get_chunk) as gzip-compressed slices of the same
+bitset.
+
+get_distances() turns a maze into a field of shortest-path distances to its
+goal (one BFS from the goal), so "how far is this player from winning" is a
+single array lookup.
+"""
+import gzip
+import time
+from array import array
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MASK32 = 0xFFFFFFFF
+
+# How many distinct mazes to keep around; a 20x20 grid is 50 bytes, 1000x1000 is 125 KB
+MAZE_CACHE_SIZE = 256
+
+# Edge length of a streamed chunk in cells (512 bytes before compression)
+CHUNK_SIZE = 64
+CHUNK_CACHE_SIZE = 4096
+
+
+def _imul(a, b):
+    return (a * b) & MASK32
+
+
+def mulberry32(seed):
+    """Return a generator of raw 32-bit outputs identical to mulberry32() in maze.js.
+
+    The JS version returns value / 2**32; callers here keep the integer so that
+    floor(rand() * n) can be computed exactly as (value * n) >> 32.
+    """
+    state = seed & MASK32
+
+    def next_uint32():
+        nonlocal state
+        state = (state + 0x6D2B79F5) & MASK32
+        t = _imul(state ^ (state >> 15), 1 | state)
+        t ^= (t + _imul(t ^ (t >> 7), 61 | t)) & MASK32
+        return (t ^ (t >> 14)) & MASK32
+
+    return next_uint32
+
+
+class MazeGrid:
+    """Immutable wall bitmap for one generated maze."""
+
+    __slots__ = ('seed', 'rows', 'cols', 'bits')
+
+    def __init__(self, seed, rows, cols, bits):
+        self.seed = seed
+        self.rows = rows
+        self.cols = cols
+        self.bits = bits
+
+    # A grid is fully determined by its seed and size, so equal keys mean equal walls
+    def __eq__(self, other):
+        return isinstance(other, MazeGrid) and \
+            (self.seed, self.rows, self.cols) == (other.seed, other.rows, other.cols)
+
+    def __hash__(self):
+        return hash((self.seed, self.rows, self.cols))
+
+    def is_wall(self, row, col):
+        if row < 0 or row >= self.rows or col < 0 or col >= self.cols:
+            return True
+        i = row * self.cols + col
+        return (self.bits[i >> 3] >> (i & 7)) & 1 == 1
+
+    def is_legal_step(self, from_row, from_col, to_row, to_col):
+        """A legal move is exactly one orthogonal step onto an open cell."""
+        if abs(to_row - from_row) + abs(to_col - from_col) != 1:
+            return False
+        return not self.is_wall(to_row, to_col)
+
+    def chunk(self, row0, col0, height, width):
+        """Pack the height x width block at (row0, col0), row-major, LSB first."""
+        packed = 0
+        bits = self.bits
+        mask = (1 << width) - 1
+        for r in range(height):
+            start = (row0 + r) * self.cols + col0
+            first, last = start >> 3, (start + width + 7) >> 3
+            row_bits = (int.from_bytes(bits[first:last + 1], 'little') >> (start & 7)) & mask
+            packed |= row_bits << (r * width)
+        return packed.to_bytes((height * width + 7) >> 3, 'little')
+
+    def to_rows(self):
+        """Expand to the list-of-lists layout generateMaze() returns (debugging/tests)."""
+        return [[1 if self.is_wall(r, c) else 0 for c in range(self.cols)] for r in range(self.rows)]
+
+
+def _generate_cells(rows, cols, seed):
+    rand = mulberry32(seed)
+    maze = bytearray(b'\x01') * (rows * cols)
+
+    r, c = 1, 1
+    maze[r * cols + c] = 0
+    stack = [(r, c)]
+
+    while stack:
+        row, col = stack[-1]
+        base = row * cols + col
+        neighbors = []
+
+        # Same order as maze.js: N, S, W, E
+        if row > 1 and maze[base - 2 * cols] == 1:
+            neighbors.append((row - 2, col))
+        if row < rows - 2 and maze[base + 2 * cols] == 1:
+            neighbors.append((row + 2, col))
+        if col > 1 and maze[base - 2] == 1:
+            neighbors.append((row, col - 2))
+        if col < cols - 2 and maze[base + 2] == 1:
+            neighbors.append((row, col + 2))
+
+        if neighbors:
+            nr, nc = neighbors[(rand() * len(neighbors)) >> 32]
+            # The wall between two cells is their midpoint
+            maze[((row + nr) >> 1) * cols + ((col + nc) >> 1)] = 0
+            maze[nr * cols + nc] = 0
+            stack.append((nr, nc))
+        else:
+            stack.pop()
+
+    return maze
+
+
+def _pack_bits(cells):
+    bits = bytearray((len(cells) + 7) >> 3)
+    for i, v in enumerate(cells):
+        if v:
+            bits[i >> 3] |= 1 << (i & 7)
+    return bytes(bits)
+
+
+@lru_cache(maxsize=MAZE_CACHE_SIZE)
+def get_maze(seed, rows, cols):
+    """Generate (or fetch from the LRU cache) the maze for a seed and size."""
+    cells = _generate_cells(rows, cols, seed)
+    return MazeGrid(seed, rows, cols, _pack_bits(cells))
+
+
+def default_goal(rows, cols):
+    """Bottom-right open cell. Carved cells sit on odd coordinates, so odd sizes end in a wall."""
+    return (rows - 1 if rows % 2 == 0 else rows - 2,
+            cols - 1 if cols % 2 == 0 else cols - 2)
+
+
+def chunk_in_range(rows, cols, chunk_row, chunk_col):
+    return 0 <= chunk_row and 0 <= chunk_col and chunk_row * CHUNK_SIZE < rows and chunk_col * CHUNK_SIZE < cols
+
+
+@lru_cache(maxsize=CHUNK_CACHE_SIZE)
+def get_chunk(maze, chunk_row, chunk_col):
+    """Gzip-compressed bits of one CHUNK_SIZE square (clipped at the maze edge), or None if out of range.
+
+    Only the compressed bytes are cached (keyed by the grid's seed and size);
+    the grid itself comes from the caller, e.g. RoomMazes.
+    """
+    rows, cols = maze.rows, maze.cols
+    if not chunk_in_range(rows, cols, chunk_row, chunk_col):
+        return None
+    row0, col0 = chunk_row * CHUNK_SIZE, chunk_col * CHUNK_SIZE
+    data = maze.chunk(row0, col0, min(CHUNK_SIZE, rows - row0), min(CHUNK_SIZE, cols - col0))
+    return gzip.compress(data, mtime=0)
+
+
+def maze_cache_info():
+    return get_maze.cache_info()
+
+
+class _RoomMaze:
+    __slots__ = ('maze', 'distances', 'used')
+
+    def __init__(self, maze):
+        self.maze = maze
+        self.distances = None
+        self.used = 0.0
+
+
+class RoomMazes:
+    """The grid of every room this process serves, held while the room is in use.
+
+    get_maze's LRU alone is not enough for move validation: with more live
+    rooms than cache slots, moves cycling through the rooms evict each grid
+    before its next use and every move regenerates a maze. `run` calls the
+    generator, e.g. eventlet's tpool.execute to keep it off the hub.
+
+    Grids are loaded on first use and dropped when the room is discarded, or
+    once nobody has used them for `idle_timeout` seconds (rooms nobody joins,
+    or whose players went quiet; they are loaded again if needed).
+    """
+
+    def __init__(self, run=None, idle_timeout=15 * 60, clock=time.monotonic):
+        self.run = run or (lambda fn, *args: fn(*args))
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        # room -> _RoomMaze, least recently used first
+        self._rooms = OrderedDict()
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def _entry(self, room, config):
+        entry = self._rooms.get(room)
+        if entry is None:
+            maze = self.run(get_maze, config['seed'], config['rows'], config['cols'])
+            # Another greenlet may have loaded it while this one waited
+            entry = self._rooms.get(room)
+            if entry is None:
+                entry = self._rooms[room] = _RoomMaze(maze)
+        now = self.clock()
+        entry.used = now
+        self._rooms.move_to_end(room)
+        self._expire(now)
+        return entry
+
+    def _expire(self, now):
+        while self._rooms:
+            room, entry = next(iter(self._rooms.items()))
+            if now - entry.used <= self.idle_timeout:
+                return
+            del self._rooms[room]
+
+    def maze(self, room, config):
+        return self._entry(room, config).maze
+
+    def distances(self, room, config):
+        # 2 bytes per cell for mazes under 64K cells, else 4 (a raid maze is 4 MB)
+        entry = self._entry(room, config)
+        if entry.distances is None:
+            entry.distances = self.run(get_distances, entry.maze, config['goal_row'], config['goal_col'])
+        return entry.distances
+
+    def discard(self, room):
+        self._rooms.pop(room, None)
+
+
+class DistanceField:
+    """Shortest-path distance from every cell to the goal; walls and unreachable cells are None."""
+
+    __slots__ = ('rows', 'cols', 'goal', 'stride', 'dist', 'unreachable')
+
+    def __init__(self, rows, cols, goal, dist, unreachable):
+        self.rows = rows
+        self.cols = cols
+        self.goal = goal
+        # The field has a one-cell border so the BFS never bounds-checks
+        self.stride = cols + 2
+        self.dist = dist
+        self.unreachable = unreachable
+
+    def distance(self, row, col):
+        if row < 0 or row >= self.rows or col < 0 or col >= self.cols:
+            return None
+        d = self.dist[(row + 1) * self.stride + col + 1]
+        return None if d == self.unreachable else d
+
+
+def _padded_walls(maze):
+    """Wall bytes (1 = wall) for the maze surrounded by a one-cell wall border, row-major."""
+    rows, cols = maze.rows, maze.cols
+    if np is not None:
+        walls = np.unpackbits(np.frombuffer(maze.bits, dtype=np.uint8), bitorder='little')[:rows * cols]
+        return np.pad(walls.reshape(rows, cols), 1, constant_values=1).tobytes()
+    stride = cols + 2
+    walls = bytearray(b'\x01') * ((rows + 2) * stride)
+    for r in range(rows):
+        for c in range(cols):
+            if not maze.is_wall(r, c):
+                walls[(r + 1) * stride + c + 1] = 0
+    return bytes(walls)
+
+
+def get_distances(maze, goal_row, goal_col):
+    """BFS distance-to-goal field for a maze; RoomMazes keeps one per live room."""
+    rows, cols = maze.rows, maze.cols
+    walls = _padded_walls(maze)
+    stride = cols + 2
+    # Any distance is below the cell count, so small mazes fit in 16 bits
+    typecode = 'H' if rows * cols < 0xFFFF else 'I'
+    unreachable = 0xFFFF if typecode == 'H' else 0xFFFFFFFF
+    dist = array(typecode, [unreachable]) * len(walls)
+
+    start = (goal_row + 1) * stride + goal_col + 1
+    if 0 <= goal_row < rows and 0 <= goal_col < cols and not walls[start]:
+        # A generated maze is a tree with long corridors, so the BFS frontier stays tiny
+        # and a plain queue beats level-by-level array operations
+        dist[start] = 0
+        queue = deque([start])
+        pop, push = queue.popleft, queue.append
+        while queue:
+            i = pop()
+            d = dist[i] + 1
+            for j in (i - 1, i + 1, i - stride, i + stride):
+                if not walls[j] and dist[j] == unreachable:
+                    dist[j] = d
+                    push(j)
+    return DistanceField(rows, cols, (goal_row, goal_col), dist, unreachable)
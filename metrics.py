@@ -0,0 +1,274 @@
+"""
+In-process instrumentation served as Prometheus text on /metrics.
+
+Everything here is a plain counter or a fixed-bucket histogram updated under
+the GIL from greenlets, so recording a sample is a dict lookup, a bisect and
+two additions -- cheap enough to leave on under full load. Gauges are computed
+by callbacks only when /metrics is scraped.
+
+Hooks:
+- instrument_socketio(): times every @socketio.on handler and counts emits
+- instrument_flask(): times every HTTP route
+- MongoCommandMetrics: pymongo CommandListener timing commands per collection
+"""
+import functools
+import inspect
+import json
+import time
+from bisect import bisect_left
+
+from pymongo import monitoring
+
+# Seconds; tuned for sub-millisecond socket handlers up to slow HTTP requests
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Serialize one emit in this many to estimate emitted bytes
+EMIT_BYTES_SAMPLE_EVERY = 16
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self.values.items():
+            yield self.name + _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for label_values, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                yield self.name + '_bucket' + _format_labels(self.labels, label_values, ('le', bound)), cumulative
+            yield self.name + '_sum' + _format_labels(self.labels, label_values), series[-1]
+            yield self.name + '_count' + _format_labels(self.labels, label_values), cumulative
+
+
+class CallbackMetric:
+    """Gauge (or externally kept counter) whose value(s) come from a callback at scrape time.
+
+    The callback returns a number, or a dict of label-value tuples to numbers.
+    """
+
+    def __init__(self, name, help, callback, labels=(), kind='gauge'):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labels = labels
+
+    def samples(self):
+        value = self.callback()
+        if isinstance(value, dict):
+            for label_values, v in value.items():
+                yield self.name + _format_labels(self.labels, label_values), v
+        else:
+            yield self.name, value
+
+
+class Metrics:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, callback, labels=()):
+        return self._add(CallbackMetric(name, help, callback, labels))
+
+    def counter_callback(self, name, help, callback, labels=()):
+        """Expose a counter that some other component already keeps."""
+        return self._add(CallbackMetric(name, help, callback, labels, kind='counter'))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for series, value in metric.samples():
+                    lines.append(f"{series} {value}")
+            except Exception:
+                # A broken gauge callback must not take the whole endpoint down
+                continue
+        return '\n'.join(lines) + '\n'
+
+
+def _positional_arity(handler):
+    params = inspect.signature(handler).parameters.values()
+    if any(p.kind == p.VAR_POSITIONAL for p in params):
+        return None
+    return sum(1 for p in params if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD))
+
+
+def instrument_socketio(socketio, metrics):
+    """Time every handler registered through socketio.on and count emitted frames.
+
+    Must run before the handlers are declared.
+    """
+    handler_seconds = metrics.histogram('mmo_socket_handler_seconds',
+                                        'Socket.IO event handler latency', ('event',))
+    handler_errors = metrics.counter('mmo_socket_handler_errors_total',
+                                     'Socket.IO event handlers that raised', ('event',))
+    emits = metrics.counter('mmo_socket_emits_total', 'Socket.IO emit calls', ('event',))
+    frames = metrics.counter('mmo_socket_frames_total',
+                             'Socket.IO frames sent to sockets on this worker', ('event',))
+    emitted_bytes = metrics.counter('mmo_socket_emitted_bytes_estimated_total',
+                                    f'Payload bytes per frame, sampled 1/{EMIT_BYTES_SAMPLE_EVERY} and scaled',
+                                    ('event',))
+
+    original_on = socketio.on
+    original_emit = socketio.emit
+
+    def on(message, namespace=None):
+        register = original_on(message, namespace)
+
+        def decorator(handler):
+            arity = _positional_arity(handler)
+
+            @functools.wraps(handler)
+            def timed(*args):
+                # Flask-SocketIO may pass extra args (e.g. a disconnect reason) the handler doesn't take
+                if arity is not None:
+                    args = args[:arity]
+                start = time.perf_counter()
+                try:
+                    return handler(*args)
+                except Exception:
+                    handler_errors.inc(message)
+                    raise
+                finally:
+                    handler_seconds.observe(time.perf_counter() - start, message)
+
+            register(timed)
+            return handler
+        return decorator
+
+    emit_count = [0]
+
+    def emit(event, *args, **kwargs):
+        emits.inc(event)
+        recipients = _local_recipients(socketio, kwargs.get('to') or kwargs.get('room'),
+                                       kwargs.get('namespace') or '/')
+        if kwargs.get('skip_sid') or kwargs.get('include_self') is False:
+            recipients = max(recipients - 1, 0)
+        frames.inc(event, amount=recipients)
+        emit_count[0] += 1
+        if args and emit_count[0] % EMIT_BYTES_SAMPLE_EVERY == 0:
+            emitted_bytes.inc(event, amount=_payload_size(args[0]) * recipients * EMIT_BYTES_SAMPLE_EVERY)
+        return original_emit(event, *args, **kwargs)
+
+    socketio.on = on
+    socketio.emit = emit
+
+
+def _local_recipients(socketio, to, namespace):
+    if to is None:
+        return 1
+    try:
+        rooms = socketio.server.manager.rooms.get(namespace, {})
+        if isinstance(to, (list, tuple)):
+            # A list of sids (interest-managed moves); each sid is its own room
+            return sum(len(rooms.get(r) or ()) for r in to)
+        room = rooms.get(to)
+        return len(room) if room else 0
+    except AttributeError:
+        return 1
+
+
+def _payload_size(payload):
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    try:
+        return len(json.dumps(payload, separators=(',', ':')))
+    except (TypeError, ValueError):
+        return 0
+
+
+def instrument_flask(app, metrics):
+    request_seconds = metrics.histogram('mmo_http_request_seconds', 'HTTP request latency by route',
+                                        ('method', 'route', 'status'))
+
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            request_seconds.observe(time.perf_counter() - start, request.method, route, response.status_code)
+        return response
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self, metrics):
+        self.seconds = metrics.histogram('mmo_mongo_command_seconds', 'MongoDB command latency',
+                                         ('collection', 'command'))
+        self.failures = metrics.counter('mmo_mongo_command_failures_total', 'Failed MongoDB commands',
+                                        ('collection', 'command'))
+        # (connection, request id) -> (collection, command) of commands in flight
+        self._inflight = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ''
+        self._inflight[(event.connection_id, event.request_id)] = (collection, event.command_name)
+
+    def succeeded(self, event):
+        labels = self._inflight.pop((event.connection_id, event.request_id), ('', event.command_name))
+        self.seconds.observe(event.duration_micros / 1e6, *labels)
+
+    def failed(self, event):
+        labels = self._inflight.pop((event.connection_id, event.request_id), ('', event.command_name))
+        self.seconds.observe(event.duration_micros / 1e6, *labels)
+        self.failures.inc(*labels)
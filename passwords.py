@@ -0,0 +1,52 @@
+"""
+bcrypt hashing off the eventlet hub.
+
+bcrypt.hashpw/checkpw take tens of milliseconds of CPU. Called directly from a
+green thread they freeze every socket on the worker, so they are run on
+eventlet's native thread pool (tpool) instead. A semaphore caps how many run
+at once so a login burst queues up here rather than saturating every core;
+`waiting` and `active` expose that queue for metrics.
+"""
+import re
+
+import bcrypt
+from eventlet import tpool
+from eventlet.semaphore import Semaphore
+
+_COST_RE = re.compile(rb'^\$2[abxy]?\$(\d{2})\$')
+
+
+class PasswordHasher:
+    def __init__(self, rounds=12, max_concurrency=4):
+        self.rounds = rounds
+        self._slots = Semaphore(max_concurrency)
+        self.waiting = 0
+        self.active = 0
+        self.hashed = 0
+        self.checked = 0
+
+    def _run(self, fn, *args):
+        self.waiting += 1
+        try:
+            self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            return tpool.execute(fn, *args)
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+    def hash(self, password):
+        self.hashed += 1
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(self.rounds))
+
+    def check(self, password, password_hash):
+        self.checked += 1
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), password_hash)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different cost factor than configured."""
+        match = _COST_RE.match(password_hash)
+        return match is None or int(match.group(1)) != self.rounds
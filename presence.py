@@ -0,0 +1,72 @@
+"""
+Lobby presence broadcasting.
+
+Instead of sending the whole online-user list to the whole lobby on every
+join/leave, changes are collected for a short debounce window and published
+as sequence-numbered diffs (`user_joined_lobby` / `user_left_lobby`). A client
+gets a full `lobby_snapshot` only when it joins or when it notices a gap in
+the sequence and asks for one with `request_lobby_snapshot`.
+"""
+import logging
+
+logger = logging.getLogger('mmo_game')
+
+LOBBY = 'lobby'
+
+
+class LobbyPresence:
+    def __init__(self, socketio, room_state, debounce=0.1):
+        self.socketio = socketio
+        self.room_state = room_state
+        self.debounce = debounce
+        # usernames whose presence changed since the last flush
+        self._touched = set()
+        self._scheduled = False
+
+    def join(self, username, sid):
+        self.room_state.add_online_user(username)
+        self._touch(username)
+        self.send_snapshot(sid)
+
+    def leave(self, username):
+        self.room_state.remove_online_user(username)
+        self._touch(username)
+
+    def send_snapshot(self, sid):
+        self.socketio.emit('lobby_snapshot', {
+            'seq': self.room_state.lobby_seq(),
+            'users': self.room_state.online_users()
+        }, to=sid)
+
+    def _touch(self, username):
+        self._touched.add(username)
+        if not self._scheduled:
+            self._scheduled = True
+            self.socketio.start_background_task(self._flush_later)
+
+    def _flush_later(self):
+        self.socketio.sleep(self.debounce)
+        self._scheduled = False
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Socket: Failed to publish lobby presence: {str(e)}")
+
+    def flush(self):
+        touched, self._touched = self._touched, set()
+        if not touched:
+            return
+        # Publish each touched user's net state at the end of the window
+        online = set(self.room_state.online_users())
+        joined = sorted(touched & online)
+        left = sorted(touched - online)
+        if joined:
+            self.socketio.emit('user_joined_lobby', {
+                'seq': self.room_state.next_lobby_seq(),
+                'users': joined
+            }, room=LOBBY)
+        if left:
+            self.socketio.emit('user_left_lobby', {
+                'seq': self.room_state.next_lobby_seq(),
+                'users': left
+            }, room=LOBBY)
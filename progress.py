@@ -0,0 +1,85 @@
+"""
+Live "who is closest to the goal" ranking per game room.
+
+Each room's maze has a precomputed distance-to-goal field (maze.get_distances,
+held per room by maze.RoomMazes), so recording a move is one array lookup and
+a dict store. The ranking itself is only sorted when it is published: a
+background greenlet per room sends a `progress` event with [username, steps
+left] pairs, closest first, every `interval` seconds while something changed.
+
+The rankings live in the worker that handles the room's moves.
+"""
+import logging
+
+logger = logging.getLogger('mmo_game')
+
+
+class _RoomProgress:
+    __slots__ = ('field', 'remaining', 'dirty')
+
+    def __init__(self, field):
+        self.field = field
+        # username -> steps left
+        self.remaining = {}
+        self.dirty = True
+
+
+class ProgressRanking:
+    def __init__(self, socketio, interval=1.0):
+        self.socketio = socketio
+        self.interval = interval
+        # room -> _RoomProgress
+        self._rooms = {}
+        self.published = 0
+
+    def rooms(self):
+        return len(self._rooms)
+
+    def track(self, room, username, row, col, field):
+        """Start ranking a player; field is the room's maze.DistanceField."""
+        if not self.interval:
+            return
+        progress = self._rooms.get(room)
+        if progress is None:
+            progress = self._rooms[room] = _RoomProgress(field)
+            self.socketio.start_background_task(self._run, room, progress)
+        progress.remaining[username] = progress.field.distance(row, col)
+        progress.dirty = True
+
+    def move(self, room, username, row, col):
+        progress = self._rooms.get(room)
+        if progress is not None and username in progress.remaining:
+            progress.remaining[username] = progress.field.distance(row, col)
+            progress.dirty = True
+
+    def untrack(self, room, username):
+        progress = self._rooms.get(room)
+        # Players on unreachable cells are tracked with a distance of None
+        if progress is not None and username in progress.remaining:
+            del progress.remaining[username]
+            progress.dirty = True
+            if not progress.remaining:
+                del self._rooms[room]
+
+    def finish(self, room):
+        """Publish the final standings now and stop ranking the room."""
+        progress = self._rooms.pop(room, None)
+        if progress is not None:
+            self._publish(room, progress)
+
+    def _publish(self, room, progress):
+        progress.dirty = False
+        # Unknown distances (off the maze's open cells) sort last
+        ranking = sorted(([username, d] for username, d in progress.remaining.items()),
+                         key=lambda entry: (entry[1] is None, entry[1] or 0, entry[0]))
+        self.socketio.emit('progress', {'ranking': ranking}, room=room)
+        self.published += 1
+
+    def _run(self, room, progress):
+        try:
+            while self._rooms.get(room) is progress:
+                if progress.dirty:
+                    self._publish(room, progress)
+                self.socketio.sleep(self.interval)
+        except Exception as e:
+            logger.error(f"Game: progress ranking for room '{room}' crashed: {str(e)}")
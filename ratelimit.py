@@ -0,0 +1,153 @@
+"""
+Token-bucket throttling of incoming Socket.IO events.
+
+Every budgeted event costs one token from a bucket per (sid, event) and one
+from a larger bucket per (username, event), so neither one socket nor one
+account spread over many sockets can flood a room or the lobby. Events over
+budget are dropped before their handler runs. The first drop of a streak can
+call an on_drop hook (e.g. to resync the client), and a socket that keeps
+getting throttled is disconnected.
+
+throttle_socketio() installs this in front of every @socketio.on handler, the
+same way metrics.instrument_socketio() does for timing.
+"""
+import functools
+import logging
+import time
+
+logger = logging.getLogger('mmo_game')
+
+
+def parse_budgets(spec, defaults):
+    """Overlay "event=rate/burst,..." (e.g. "move=15/30,start_game=0.2/2") on the default budgets."""
+    budgets = dict(defaults)
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        event, _, value = item.partition('=')
+        rate, _, burst = value.partition('/')
+        budgets[event.strip()] = (float(rate), float(burst or rate))
+    return budgets
+
+
+class EventRateLimiter:
+    # Users idle long enough for every bucket to refill are forgotten past this many
+    MAX_IDLE_USERS = 10000
+
+    def __init__(self, budgets, user_multiplier=3, abuse_drops=50, abuse_window=10.0, clock=time.monotonic):
+        for event, (rate, burst) in budgets.items():
+            # A bucket that never refills (or never holds a whole token) would block the event for good
+            if not rate > 0 or not burst >= 1:
+                raise ValueError(f"Invalid rate limit for '{event}': {rate}/{burst} (need rate > 0, burst >= 1)")
+        # event -> (tokens per second, bucket size)
+        self.budgets = budgets
+        self.user_multiplier = user_multiplier
+        self.abuse_drops = abuse_drops
+        self.abuse_window = abuse_window
+        self.clock = clock
+        # sid / username -> {event: [tokens, last refill]}
+        self._sids = {}
+        self._users = {}
+        # sid -> [drops in window, window start]
+        self._drops = {}
+        # (sid, event) pairs currently being dropped, so on_drop fires once per streak
+        self._dropping = set()
+        self.throttled = {}
+        self.disconnects = 0
+
+    def _take(self, buckets, key, event, rate, burst, now):
+        per_key = buckets.get(key)
+        if per_key is None:
+            per_key = buckets[key] = {}
+        bucket = per_key.get(event)
+        if bucket is None:
+            bucket = per_key[event] = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def allow(self, event, sid, username=None):
+        """True if the event fits both budgets; consumes a token from each if so."""
+        budget = self.budgets.get(event)
+        if budget is None:
+            return True
+        rate, burst = budget
+        now = self.clock()
+        sid_bucket = self._take(self._sids, sid, event, rate, burst, now)
+        user_bucket = None
+        if username is not None:
+            user_bucket = self._take(self._users, username, event, rate * self.user_multiplier,
+                                     burst * self.user_multiplier, now)
+        if sid_bucket[0] < 1 or (user_bucket is not None and user_bucket[0] < 1):
+            return False
+        sid_bucket[0] -= 1
+        if user_bucket is not None:
+            user_bucket[0] -= 1
+        return True
+
+    def dropped(self, event, sid):
+        """Record a drop. Returns (first drop of a streak, socket should be disconnected)."""
+        self.throttled[event] = self.throttled.get(event, 0) + 1
+        first = (sid, event) not in self._dropping
+        self._dropping.add((sid, event))
+
+        now = self.clock()
+        window = self._drops.get(sid)
+        if window is None or now - window[1] > self.abuse_window:
+            window = self._drops[sid] = [0, now]
+        window[0] += 1
+        return first, window[0] > self.abuse_drops
+
+    def accepted(self, event, sid):
+        self._dropping.discard((sid, event))
+
+    def forget(self, sid):
+        self._sids.pop(sid, None)
+        self._drops.pop(sid, None)
+        self._dropping = {pair for pair in self._dropping if pair[0] != sid}
+        if len(self._users) > self.MAX_IDLE_USERS:
+            self._prune_users()
+
+    def _prune_users(self):
+        now = self.clock()
+        for username, per_event in list(self._users.items()):
+            if all(now - last >= (self.budgets[event][1] / self.budgets[event][0])
+                   for event, (_, last) in per_event.items()):
+                del self._users[username]
+
+
+def throttle_socketio(socketio, limiter, identify, on_drop=None):
+    """Check every @socketio.on handler's event against the limiter before it runs.
+
+    identify() returns (sid, username or None) for the current event. on_drop
+    maps event names to callbacks run with the handler's args on the first
+    drop of a streak. Must run before the handlers are declared.
+    """
+    on_drop = on_drop or {}
+    original_on = socketio.on
+
+    def on(message, namespace=None):
+        register = original_on(message, namespace)
+        if message not in limiter.budgets:
+            return register
+
+        def decorator(handler):
+            @functools.wraps(handler)
+            def throttled(*args):
+                sid, username = identify()
+                if limiter.allow(message, sid, username):
+                    limiter.accepted(message, sid)
+                    return handler(*args)
+                first, abusive = limiter.dropped(message, sid)
+                if abusive:
+                    limiter.disconnects += 1
+                    limiter.forget(sid)
+                    logger.warning(f"Socket: Disconnecting {username or sid} for flooding '{message}' events.")
+                    socketio.server.disconnect(sid, namespace=namespace or '/')
+                elif first and message in on_drop:
+                    on_drop[message](*args)
+
+            register(throttled)
+            return handler
+        return decorator
+
+    socketio.on = on
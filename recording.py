@@ -0,0 +1,202 @@
+"""
+Append-only match recordings for replays and cheat review.
+
+Each recorded room gets a binary file: a 32-byte header (seed, maze size,
+goal, wall-clock start) followed by fixed 12-byte records
+
+    uint32 ms since start | uint8 event | pad | uint16 player id | uint16 row | uint16 col
+
+so recording a move is a struct.pack onto the room's in-memory buffer. A
+background greenlet appends the buffers to disk in batches on eventlet's
+native thread pool; the hot path never touches the file system. Usernames do
+not fit a fixed record, so joins also append "id<TAB>username" lines to a
+small sidecar file.
+
+Files are named by a hash of the room id (rooms are client-chosen strings).
+A room is recorded by the worker that created it and only sees the events
+that worker handles, so recording needs a single worker (STATE_BACKEND=memory).
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+from eventlet import tpool
+
+logger = logging.getLogger('mmo_game')
+
+MAGIC = b'MMR1'
+HEADER = struct.Struct('<4sIHHHHd8x')
+RECORD = struct.Struct('<IBxHHH')
+
+EVENT_JOIN = 1
+EVENT_MOVE = 2
+EVENT_LEAVE = 3
+EVENT_WIN = 4
+EVENT_NAMES = {EVENT_JOIN: 'join', EVENT_MOVE: 'move', EVENT_LEAVE: 'leave', EVENT_WIN: 'win'}
+
+# Records decoded per chunk of a streamed replay
+REPLAY_BATCH = 1024
+
+
+class _Recording:
+    __slots__ = ('started', 'buffer', 'names', 'finished', 'last_record', 'created')
+
+    def __init__(self, header):
+        self.started = time.monotonic()
+        self.buffer = bytearray(header)
+        self.names = []
+        self.finished = False
+        self.last_record = self.started
+        # False until the first batch has (re)created the files
+        self.created = False
+
+
+class MatchRecorder:
+    def __init__(self, socketio, directory, enabled=True, flush_interval=1.0, idle_timeout=15 * 60):
+        self.socketio = socketio
+        self.directory = directory
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+        # room -> _Recording for rooms being recorded by this worker
+        self._rooms = {}
+        self._loop_running = False
+        self.records = 0
+        self.bytes_written = 0
+        self.flush_seconds = 0.0
+        if enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    def paths(self, room):
+        name = hashlib.sha256(room.encode('utf-8')).hexdigest()[:32]
+        base = os.path.join(self.directory, name)
+        return base + '.mmr', base + '.players'
+
+    def pending_bytes(self):
+        return sum(len(r.buffer) for r in self._rooms.values())
+
+    # Recording
+    def start(self, room, seed, rows, cols, goal_row, goal_col):
+        if not self.enabled:
+            return
+        self._rooms[room] = _Recording(HEADER.pack(MAGIC, seed, rows, cols, goal_row, goal_col, time.time()))
+        if not self._loop_running:
+            self._loop_running = True
+            self.socketio.start_background_task(self._run)
+
+    def _append(self, room, event, player_id, row, col):
+        recording = self._rooms.get(room)
+        if recording is None or recording.finished:
+            return None
+        now = time.monotonic()
+        recording.buffer += RECORD.pack(int((now - recording.started) * 1000), event, player_id, row, col)
+        recording.last_record = now
+        self.records += 1
+        return recording
+
+    def move(self, room, player_id, row, col):
+        self._append(room, EVENT_MOVE, player_id, row, col)
+
+    def join(self, room, player_id, username, row, col):
+        recording = self._append(room, EVENT_JOIN, player_id, row, col)
+        if recording is not None:
+            recording.names.append(f"{player_id}\t{username}\n")
+
+    def leave(self, room, player_id, row, col):
+        self._append(room, EVENT_LEAVE, player_id, row, col)
+
+    def finish(self, room, player_id, row, col):
+        """Record the win; the recording is written out and closed on the next flush."""
+        if self._append(room, EVENT_WIN, player_id, row, col) is not None:
+            self._rooms[room].finished = True
+
+    # Writing
+    def _run(self):
+        try:
+            while self._rooms:
+                self.socketio.sleep(self.flush_interval)
+                self.flush()
+        except Exception as e:
+            logger.error(f"Recording: flush loop crashed: {str(e)}")
+        finally:
+            self._loop_running = False
+
+    def flush(self):
+        now = time.monotonic()
+        batch = []
+        for room, recording in list(self._rooms.items()):
+            if recording.buffer or recording.names:
+                batch.append((self.paths(room), not recording.created, bytes(recording.buffer),
+                              ''.join(recording.names)))
+                recording.created = True
+                recording.buffer = bytearray()
+                recording.names = []
+            if recording.finished or now - recording.last_record > self.idle_timeout:
+                del self._rooms[room]
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            self.bytes_written += tpool.execute(_write_batch, batch)
+        except OSError as e:
+            logger.error(f"Recording: Failed to write {len(batch)} recording(s): {str(e)}")
+        self.flush_seconds += time.perf_counter() - start
+
+    # Replay
+    def replay(self, room, raw=False):
+        """Generator streaming a recording (raw bytes or NDJSON), or None if there is none."""
+        path, names_path = self.paths(room)
+        if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+            return None
+        if raw:
+            return _stream_raw(path)
+        names = {}
+        if os.path.exists(names_path):
+            with open(names_path) as f:
+                for line in f:
+                    player_id, _, username = line.rstrip('\n').partition('\t')
+                    names[player_id] = username
+        return _stream_ndjson(path, names)
+
+
+def _write_batch(batch):
+    written = 0
+    for (path, names_path), create, data, names in batch:
+        # A reused room id starts a fresh recording
+        if data or create:
+            with open(path, 'wb' if create else 'ab') as f:
+                f.write(data)
+            written += len(data)
+        if names or create:
+            with open(names_path, 'w' if create else 'a') as f:
+                f.write(names)
+    return written
+
+
+def _stream_raw(path):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        step = RECORD.size * REPLAY_BATCH
+        for offset in range(0, len(mm), step):
+            yield mm[offset:offset + step]
+
+
+def _stream_ndjson(path, names):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, seed, rows, cols, goal_row, goal_col, started_at = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            return
+        yield json.dumps({'seed': seed, 'rows': rows, 'cols': cols, 'goal': [goal_row, goal_col],
+                          'started_at': started_at, 'players': names}) + '\n'
+        # A partially written trailing record is ignored
+        end = HEADER.size + (len(mm) - HEADER.size) // RECORD.size * RECORD.size
+        step = RECORD.size * REPLAY_BATCH
+        for offset in range(HEADER.size, end, step):
+            lines = []
+            for t, event, player_id, row, col in RECORD.iter_unpack(mm[offset:min(offset + step, end)]):
+                lines.append(json.dumps({'t': t, 'event': EVENT_NAMES.get(event, event), 'player': player_id,
+                                         'row': row, 'col': col}))
+            yield '\n'.join(lines) + '\n'
@@ -0,0 +1,78 @@
+"""
+Per-room event sequence and a short ring buffer of recent deltas.
+
+Every join, leave, move and win in a game room gets the next number of that
+room's sequence, and the JSON events sent to clients carry it as `seq`. A
+client that reconnects says which seq it saw last; if the deltas after it are
+still in the ring buffer, it gets just the players who changed since (with
+their current state) and who left; otherwise it gets a snapshot of the room.
+
+The log lives in the worker process, so it only sees the events that worker
+handled; with a shared room-state backend, resyncs use snapshots.
+"""
+from collections import deque
+
+JOIN = 'join'
+MOVE = 'move'
+LEAVE = 'leave'
+WIN = 'win'
+
+
+class _RoomLog:
+    __slots__ = ('seq', 'deltas')
+
+    def __init__(self, size):
+        self.seq = 0
+        # (seq, kind, username)
+        self.deltas = deque(maxlen=size)
+
+
+class RoomEventLog:
+    def __init__(self, size=256):
+        self.size = size
+        # room -> _RoomLog
+        self._rooms = {}
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def seq(self, room):
+        log = self._rooms.get(room)
+        return log.seq if log else 0
+
+    def record(self, room, kind, username):
+        """Append a delta and return its seq."""
+        log = self._rooms.get(room)
+        if log is None:
+            log = self._rooms[room] = _RoomLog(self.size)
+        log.seq += 1
+        log.deltas.append((log.seq, kind, username))
+        return log.seq
+
+    def since(self, room, seq):
+        """Net changes after `seq`: (usernames joined or moved, usernames left, winner or None).
+
+        Returns None if the buffer no longer reaches back to `seq` (or `seq` is
+        not from this room's sequence), in which case the caller needs a snapshot.
+        """
+        log = self._rooms.get(room)
+        if log is None or not isinstance(seq, int) or seq < 0 or seq > log.seq:
+            return None
+        if log.seq - seq > len(log.deltas):
+            return None
+        changed, left, winner = set(), set(), None
+        for delta_seq, kind, username in log.deltas:
+            if delta_seq <= seq:
+                continue
+            if kind == LEAVE:
+                changed.discard(username)
+                left.add(username)
+            elif kind == WIN:
+                winner = username
+            else:
+                left.discard(username)
+                changed.add(username)
+        return changed, left, winner
+
+    def discard(self, room):
+        self._rooms.pop(room, None)
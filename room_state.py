@@ -0,0 +1,277 @@
+"""
+Room and presence state backends.
+
+The socket handlers keep lobby presence, room configuration (maze seed and
+size) and per-player records through this interface instead of module-level
+dicts, so several workers or containers can serve the same lobby and rooms.
+
+- InMemoryRoomState: the original single-process behaviour (default).
+- RedisRoomState: shared state in Redis; pair it with SocketIO(message_queue=...)
+  so emits reach sockets connected to other workers. It accepts any client
+  with the redis-py API, so tests can pass a fakeredis instance.
+
+A room config is a dict with 'seed', 'rows', 'cols', 'goal_row', 'goal_col'
+and 'settled'; a player
+record is the dict sent to clients (including the small per-room player 'id'
+used by the binary wire format) plus the owning 'sid'.
+"""
+import json
+import time
+from collections import OrderedDict
+
+from maze import default_goal
+
+
+class InMemoryRoomState:
+    # Finished rooms to remember so late goal events stay de-duplicated
+    SETTLED_HISTORY = 4096
+    # Unfinished rooms without players are forgotten this long after creation, like RedisRoomState.ROOM_TTL
+    ROOM_TTL = 6 * 60 * 60
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._online = set()
+        self._lobby_seq = 0
+        self._rooms = {}
+        self._players = {}
+        self._next_ids = {}
+        self._settled = OrderedDict()
+        # Unsettled room -> creation (or last extension) time, oldest first
+        self._expiry = OrderedDict()
+
+    # Lobby presence
+    def add_online_user(self, username):
+        self._online.add(username)
+
+    def remove_online_user(self, username):
+        self._online.discard(username)
+
+    def online_users(self):
+        return list(self._online)
+
+    def lobby_seq(self):
+        return self._lobby_seq
+
+    def next_lobby_seq(self):
+        self._lobby_seq += 1
+        return self._lobby_seq
+
+    # Rooms
+    def create_room(self, room, seed, rows, cols, goal=None):
+        """Create a room; False (and nothing changes) if the room already exists."""
+        now = self.clock()
+        self._expire(now)
+        if room in self._rooms:
+            return False
+        goal_row, goal_col = goal or default_goal(rows, cols)
+        self._rooms[room] = {'seed': seed, 'rows': rows, 'cols': cols,
+                             'goal_row': goal_row, 'goal_col': goal_col, 'settled': False}
+        self._expiry[room] = now
+        return True
+
+    def _expire(self, now):
+        while self._expiry:
+            room, created = next(iter(self._expiry.items()))
+            if now - created < self.ROOM_TTL:
+                return
+            del self._expiry[room]
+            if self._players.get(room):
+                # Still being played; look again after another ROOM_TTL
+                self._expiry[room] = now
+                continue
+            self._rooms.pop(room, None)
+            self._next_ids.pop(room, None)
+
+    def get_room(self, room):
+        return self._rooms.get(room)
+
+    def all_rooms(self):
+        """Rooms that currently have players."""
+        return list(self._players.keys())
+
+    def mark_settled(self, room):
+        """Atomically flag a room as settled; True only for the first caller."""
+        config = self._rooms.get(room)
+        if config is None or config['settled']:
+            return False
+        config['settled'] = True
+        self._expiry.pop(room, None)
+        self._settled[room] = True
+        if len(self._settled) > self.SETTLED_HISTORY:
+            old, _ = self._settled.popitem(last=False)
+            self._rooms.pop(old, None)
+            if not self._players.get(old):
+                self._players.pop(old, None)
+                self._next_ids.pop(old, None)
+        return True
+
+    # Players
+    def next_player_id(self, room):
+        player_id = self._next_ids.get(room, 0)
+        self._next_ids[room] = player_id + 1
+        return player_id
+
+    def add_player(self, room, record):
+        self._players.setdefault(room, {})[record['username']] = record
+
+    def get_player(self, room, username):
+        return self._players.get(room, {}).get(username)
+
+    def get_room_and_player(self, room, username):
+        return self._rooms.get(room), self.get_player(room, username)
+
+    def get_players(self, room):
+        return dict(self._players.get(room, {}))
+
+    def player_names(self, room):
+        return list(self._players.get(room, {}).keys())
+
+    def update_position(self, room, player, row, col):
+        player['row'] = row
+        player['col'] = col
+
+    def remove_player(self, room, username):
+        players = self._players.get(room)
+        if players is None or players.pop(username, None) is None:
+            return False
+        if not players:
+            del self._players[room]
+        return True
+
+
+class RedisRoomState:
+    # Rooms (and their players) disappear this long after the last change
+    ROOM_TTL = 6 * 60 * 60
+
+    def __init__(self, client, prefix='mmo:'):
+        self.redis = client
+        self.prefix = prefix
+
+    def _key(self, *parts):
+        return self.prefix + ':'.join(parts)
+
+    # Lobby presence
+    def add_online_user(self, username):
+        self.redis.sadd(self._key('online'), username)
+
+    def remove_online_user(self, username):
+        self.redis.srem(self._key('online'), username)
+
+    def online_users(self):
+        return [_text(u) for u in self.redis.smembers(self._key('online'))]
+
+    def lobby_seq(self):
+        return int(self.redis.get(self._key('lobby_seq')) or 0)
+
+    def next_lobby_seq(self):
+        return self.redis.incr(self._key('lobby_seq'))
+
+    # Rooms
+    def create_room(self, room, seed, rows, cols, goal=None):
+        from redis.exceptions import WatchError
+        goal_row, goal_col = goal or default_goal(rows, cols)
+        key = self._key('room', room)
+        with self.redis.pipeline() as pipe:
+            try:
+                # Only if nobody else created the room in the meantime
+                pipe.watch(key)
+                if pipe.exists(key):
+                    return False
+                pipe.multi()
+                pipe.hset(key, mapping={'seed': seed, 'rows': rows, 'cols': cols,
+                                        'goal_row': goal_row, 'goal_col': goal_col})
+                pipe.expire(key, self.ROOM_TTL)
+                pipe.execute()
+            except WatchError:
+                return False
+        return True
+
+    def get_room(self, room):
+        return _room_config(self.redis.hgetall(self._key('room', room)))
+
+    def all_rooms(self):
+        """Rooms that currently have players."""
+        return [_text(r) for r in self.redis.smembers(self._key('rooms'))]
+
+    def mark_settled(self, room):
+        key = self._key('room', room)
+        if not self.redis.exists(key):
+            return False
+        return bool(self.redis.hsetnx(key, 'settled', 1))
+
+    # Players
+    def next_player_id(self, room):
+        key = self._key('room', room, 'ids')
+        pipe = self.redis.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, self.ROOM_TTL)
+        return pipe.execute()[0] - 1
+
+    def add_player(self, room, record):
+        key = self._key('room', room, 'players')
+        pipe = self.redis.pipeline()
+        pipe.hset(key, record['username'], json.dumps(record))
+        pipe.expire(key, self.ROOM_TTL)
+        pipe.sadd(self._key('rooms'), room)
+        pipe.execute()
+
+    def get_player(self, room, username):
+        raw = self.redis.hget(self._key('room', room, 'players'), username)
+        return json.loads(raw) if raw else None
+
+    def get_room_and_player(self, room, username):
+        # One round trip for the move hot path
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self._key('room', room))
+        pipe.hget(self._key('room', room, 'players'), username)
+        config, raw = pipe.execute()
+        return _room_config(config), json.loads(raw) if raw else None
+
+    def get_players(self, room):
+        raw = self.redis.hgetall(self._key('room', room, 'players'))
+        return {_text(k): json.loads(v) for k, v in raw.items()}
+
+    def player_names(self, room):
+        return [_text(k) for k in self.redis.hkeys(self._key('room', room, 'players'))]
+
+    def update_position(self, room, player, row, col):
+        player['row'] = row
+        player['col'] = col
+        self.redis.hset(self._key('room', room, 'players'), player['username'], json.dumps(player))
+
+    def remove_player(self, room, username):
+        key = self._key('room', room, 'players')
+        removed = self.redis.hdel(key, username)
+        if not self.redis.exists(key):
+            self.redis.srem(self._key('rooms'), room)
+        return bool(removed)
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _room_config(raw):
+    if not raw:
+        return None
+    raw = {_text(k): _text(v) for k, v in raw.items()}
+    rows, cols = int(raw['rows']), int(raw['cols'])
+    goal_row, goal_col = default_goal(rows, cols)
+    return {
+        'seed': int(raw['seed']),
+        'rows': rows,
+        'cols': cols,
+        'goal_row': int(raw.get('goal_row', goal_row)),
+        'goal_col': int(raw.get('goal_col', goal_col)),
+        'settled': raw.get('settled') == '1',
+    }
+
+
+def create_room_state(backend, redis_url=None):
+    """Build the backend named by STATE_BACKEND ('memory' or 'redis')."""
+    if backend == 'memory':
+        return InMemoryRoomState()
+    if backend == 'redis':
+        import redis
+        return RedisRoomState(redis.Redis.from_url(redis_url or 'redis://localhost:6379/0'))
+    raise ValueError(f"Unknown state backend '{backend}'")
@@ -0,0 +1,86 @@
+"""
+End-of-game stat settlement.
+
+When a room is won every player's won/lose/played/exp/level changes at once.
+Instead of several $inc/find_one/$set round trips per player inside the socket
+handler, the whole room is settled with one unordered bulk_write of pipeline
+updates (the level-up check runs inside the update), on a background greenlet
+so the winning move's broadcast never waits for the database.
+"""
+import logging
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger('mmo_game')
+
+WIN_EXP = 10
+LOSE_EXP = 2
+EXP_PER_LEVEL = 30
+
+def _add(field, amount, default=0):
+    return {"$add": [{"$ifNull": [f"${field}", default]}, amount]}
+
+
+def stat_pipeline(won):
+    """Update pipeline applying one game's result (and a possible level-up) to a user."""
+    levelled_up = {"$gte": ["$exp", EXP_PER_LEVEL]}
+    return [
+        {"$set": {
+            "won": _add("won", 1 if won else 0),
+            "lose": _add("lose", 0 if won else 1),
+            "played": _add("played", 1),
+            "exp": _add("exp", WIN_EXP if won else LOSE_EXP),
+        }},
+        # Stage two sees the incremented exp from stage one
+        {"$set": {
+            "level": {"$cond": [levelled_up, _add("level", 1, default=1), {"$ifNull": ["$level", 1]}]},
+            "exp": {"$cond": [levelled_up, {"$subtract": ["$exp", EXP_PER_LEVEL]}, "$exp"]},
+            # Stored so the win-rate leaderboard can be served from an index
+            "win_rate": {"$divide": ["$won", "$played"]},
+        }},
+    ]
+
+
+class StatSettlement:
+    def __init__(self, socketio, mongo, room_state):
+        self.socketio = socketio
+        self.mongo = mongo
+        # Shared room state decides which worker gets to settle a room
+        self.room_state = room_state
+        # Called as listener(room, winner, players) once the write was attempted
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def settle(self, room, winner, players):
+        """Schedule the stat write for a finished room.
+
+        Returns False (and does nothing) if the room was already settled, so a
+        duplicate goal event can never pay out twice.
+        """
+        if not self.room_state.mark_settled(room):
+            return False
+
+        self.socketio.start_background_task(self._write, room, winner, list(players))
+        return True
+
+    def _write(self, room, winner, players):
+        ops = [UpdateOne({"username": player}, stat_pipeline(player == winner)) for player in players]
+        if not ops:
+            return
+        try:
+            self.mongo.db.users.bulk_write(ops, ordered=False)
+            logger.info(f"Game: Settled room '{room}' for {len(ops)} player(s), winner '{winner}'.")
+        except PyMongoError as e:
+            logger.error(f"Game: Failed to settle room '{room}': {str(e)}")
+        except Exception as e:
+            logger.error(f"Game: Unexpected error settling room '{room}': {str(e)}")
+
+        # Listeners run either way: they re-read what was written and close out the room
+        for listener in self._listeners:
+            try:
+                listener(room, winner, players)
+            except Exception as e:
+                logger.error(f"Game: Settlement listener failed for room '{room}': {str(e)}")
@@ -1,27 +1,135 @@
 // game.js — Multiplayer Maze Game (with debugging logs)
-const socket = io();
+// Websocket only: polling would need sticky sessions when several workers serve the game
+const socket = io({ transports: ['websocket'] });
 
 const params = new URLSearchParams(window.location.search);
 const ROOM = params.get('room');
-const seed = parseInt(params.get('seed'), 10);
-const numRows = 20, numCols = 20;
-const goalR = numRows-1, goalC = numCols-1;
+// Room maze config rendered by the server: seed, rows, cols, goal, chunk
+const MAZE = window.MAZE;
+const numRows = MAZE.rows, numCols = MAZE.cols;
+const [goalR, goalC] = MAZE.goal;
+
+// Small mazes are generated locally; large ones are fetched in bit-packed chunks around the player
+const localMaze = MAZE.chunk ? null : generateMaze(numRows, numCols, MAZE.seed);
+const CHUNK = MAZE.chunk;
+const MAX_CHUNKS = 64;
+const chunks = new Map();  // "row,col" -> Uint8Array of wall bits, or null while loading
+
+function loadChunk(cr, cc) {
+  const key = `${cr},${cc}`;
+  if (chunks.has(key)) {
+    // Re-insert so the Map's order stays least-recently-used first
+    const bits = chunks.get(key);
+    chunks.delete(key);
+    chunks.set(key, bits);
+    return;
+  }
+  chunks.set(key, null);
+  fetch(`/maze/${encodeURIComponent(ROOM)}/${cr}/${cc}`)
+    .then(res => {
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+      return res.arrayBuffer();
+    })
+    .then(buf => {
+      chunks.set(key, new Uint8Array(buf));
+      dirty = true;
+    })
+    .catch(err => {
+      console.warn(`[MAZE] Chunk ${key} failed:`, err);
+      chunks.delete(key);
+    });
+  for (const old of chunks.keys()) {
+    if (chunks.size <= MAX_CHUNKS) break;
+    chunks.delete(old);
+    layers.delete(old);
+  }
+}
+
+// Keep the chunks under and around the viewport loaded
+function ensureChunksAround(row, col) {
+  if (!CHUNK) return;
+  const r0 = Math.max(0, Math.floor((row - VIEW_CELLS) / CHUNK));
+  const r1 = Math.floor(Math.min(numRows - 1, row + VIEW_CELLS) / CHUNK);
+  const c0 = Math.max(0, Math.floor((col - VIEW_CELLS) / CHUNK));
+  const c1 = Math.floor(Math.min(numCols - 1, col + VIEW_CELLS) / CHUNK);
+  for (let cr = r0; cr <= r1; cr++)
+    for (let cc = c0; cc <= c1; cc++) loadChunk(cr, cc);
+}
+
+// Cells that are not loaded yet count as walls
+function isWall(r, c) {
+  if (r < 0 || r >= numRows || c < 0 || c >= numCols) return true;
+  if (localMaze) return localMaze[r][c] === 1;
+  const cr = Math.floor(r / CHUNK), cc = Math.floor(c / CHUNK);
+  const bits = chunks.get(`${cr},${cc}`);
+  if (!bits) return true;
+  const width = Math.min(CHUNK, numCols - cc * CHUNK);
+  const i = (r - cr * CHUNK) * width + (c - cc * CHUNK);
+  return ((bits[i >> 3] >> (i & 7)) & 1) === 1;
+}
 
-const maze = generateMaze(numRows, numCols, seed);
+// Walls are rasterised once per chunk (or once for a local maze) at one pixel per cell and
+// scaled up when blitted, so a frame costs a few drawImage calls instead of a fillRect per wall
+const LAYER = CHUNK || Math.max(numRows, numCols);
+const layers = new Map();  // "row,col" -> canvas
+
+function mazeLayer(cr, cc) {
+  const key = `${cr},${cc}`;
+  if (layers.has(key)) return layers.get(key);
+  if (!localMaze && !chunks.get(key)) return null;
+  const r0 = cr * LAYER, c0 = cc * LAYER;
+  const h = Math.min(LAYER, numRows - r0), w = Math.min(LAYER, numCols - c0);
+  const layer = document.createElement('canvas');
+  layer.width = w;
+  layer.height = h;
+  const lctx = layer.getContext('2d');
+  const image = lctx.createImageData(w, h);
+  for (let r = 0; r < h; r++)
+    for (let c = 0; c < w; c++)
+      if (isWall(r0 + r, c0 + c)) {
+        const i = (r * w + c) * 4;
+        image.data[i] = image.data[i + 1] = image.data[i + 2] = 0x22;
+        image.data[i + 3] = 255;
+      }
+  lctx.putImageData(image, 0, 0);
+  layers.set(key, layer);
+  return layer;
+}
 
 const USERNAME   = window.PLAYER_NAME || 'Guest';
 const AVATAR_URL = window.PLAYER_IMG_URL || null;
 
-socket.emit('join_room', { room: ROOM, username: USERNAME });
+// Ask for the compact binary move format; the server answers with what it enabled
+let protocol = 'json';
+const playersById = {};
+// Latest room event seq seen; after a reconnect the server only sends what changed since
+let lastSeq = null;
+socket.on('connect', () => {
+  const join = { room: ROOM, username: USERNAME, protocol: 'binary' };
+  if (lastSeq !== null) join.since = lastSeq;
+  socket.emit('join_room', join);
+});
+
+function seen(data) {
+  if (data && typeof data.seq === 'number' && (lastSeq === null || data.seq > lastSeq)) lastSeq = data.seq;
+}
 
-socket.on('update_players', players => {
+function listPlayers(entries) {
   const ul = document.getElementById('player-names');
   ul.innerHTML = '';
-  players.forEach(p => {
+  entries.forEach(text => {
     const li = document.createElement('li');
-    li.textContent = p;
+    li.textContent = text;
     ul.appendChild(li);
   });
+}
+
+socket.on('update_players', listPlayers);
+
+// Closest to the goal first: [[username, steps left], ...]
+socket.on('progress', data => {
+  listPlayers(data.ranking.map(([name, steps]) =>
+    steps === null ? name : `${name} — ${steps} step${steps === 1 ? '' : 's'}`));
 });
 
 const canvas = document.getElementById('game-canvas');
@@ -29,7 +137,72 @@ const ctx    = canvas.getContext('2d');
 const SIZE   = Math.min(canvas.clientWidth, canvas.clientHeight);
 canvas.width  = SIZE;
 canvas.height = SIZE;
-const cell = SIZE / numRows;
+// Cells across the canvas; bigger mazes scroll with the local player
+const VIEW_CELLS = 21;
+const cell = SIZE / Math.min(Math.max(numRows, numCols), VIEW_CELLS);
+// Nearest-neighbour scaling keeps the one-pixel-per-cell maze layers crisp
+ctx.imageSmoothingEnabled = false;
+// Read once; it never changes while the page is open
+const PRIMARY_COLOR = getComputedStyle(document.documentElement).getPropertyValue('--primary-color').trim();
+const PLAYER_RADIUS = cell * 0.35;
+// Set whenever something visible changes; frames with nothing new are not redrawn
+let dirty = true;
+
+// Players are drawn from pre-rendered sprites: avatars clipped to a circle (shared by URL),
+// or a coloured disc with the username for players without one
+const sprites = new Map();  // avatar URL or "name:<username>" -> canvas
+
+function makeSprite(width, draw) {
+  const sprite = document.createElement('canvas');
+  sprite.width = width;
+  sprite.height = Math.ceil(2 * PLAYER_RADIUS);
+  draw(sprite.getContext('2d'), sprite.width / 2, sprite.height / 2);
+  return sprite;
+}
+
+function spriteFor(player) {
+  const img = player.img;
+  if (img && img.complete && img.naturalWidth > 0) {
+    let sprite = sprites.get(img.src);
+    if (!sprite) {
+      sprite = makeSprite(Math.ceil(2 * PLAYER_RADIUS), (g, x, y) => {
+        g.beginPath(); g.arc(x, y, PLAYER_RADIUS, 0, 2 * Math.PI); g.clip();
+        g.drawImage(img, x - PLAYER_RADIUS, y - PLAYER_RADIUS, 2 * PLAYER_RADIUS, 2 * PLAYER_RADIUS);
+      });
+      sprites.set(img.src, sprite);
+    }
+    return sprite;
+  }
+  const key = `name:${player.username}`;
+  let sprite = sprites.get(key);
+  if (!sprite) {
+    ctx.font = '8px Orbitron';
+    // Wide enough for names that spill past the disc
+    const width = Math.ceil(Math.max(2 * PLAYER_RADIUS, ctx.measureText(player.username).width + 2));
+    sprite = makeSprite(width, (g, x, y) => {
+      g.fillStyle = PRIMARY_COLOR;
+      g.beginPath(); g.arc(x, y, PLAYER_RADIUS, 0, 2 * Math.PI); g.fill();
+      g.fillStyle = '#fff'; g.textAlign = 'center'; g.textBaseline = 'middle'; g.font = '8px Orbitron';
+      g.fillText(player.username, x, y);
+    });
+    sprites.set(key, sprite);
+  }
+  return sprite;
+}
+
+// Name sprites rendered before the web font arrived used a fallback font
+document.fonts.ready.then(() => {
+  for (const key of sprites.keys()) if (key.startsWith('name:')) sprites.delete(key);
+  dirty = true;
+});
+
+function loadAvatar(url) {
+  if (!url || url === 'null') return null;  // Do not load invalid avatars
+  const i = new Image();
+  i.onload = () => { dirty = true; };
+  i.src = url;
+  return i;
+}
 
 const localPlayer = {
   username: USERNAME,
@@ -38,14 +211,7 @@ const localPlayer = {
   col: 1,
   x: cell + cell / 2,
   y: cell + cell / 2,
-  img: (() => {
-    if (AVATAR_URL) {
-      const i = new Image();
-      i.src = AVATAR_URL;
-      return i;
-    }
-    return null;
-  })()
+  img: loadAvatar(AVATAR_URL)
 };
 
 const otherPlayers = {};
@@ -64,7 +230,7 @@ function tryStartMove(dr, dc) {
 
 
 
-  if (nr < 0 || nr >= numRows || nc < 0 || nc >= numCols || maze[nr][nc] === 1) {
+  if (isWall(nr, nc)) {
     console.warn(`[MOVE] Blocked or invalid move to (${nr}, ${nc})`);
     return;
   }
@@ -77,7 +243,14 @@ function tryStartMove(dr, dc) {
   targetY = nr * cell + cell / 2;
   moving = true;
 
-  socket.emit('move', { room: ROOM, username: USERNAME, row: nr, col: nc });
+  if (protocol === 'binary') {
+    const frame = new DataView(new ArrayBuffer(4));
+    frame.setUint16(0, nr, true);
+    frame.setUint16(2, nc, true);
+    socket.emit('mv', frame.buffer);
+  } else {
+    socket.emit('move', { room: ROOM, username: USERNAME, row: nr, col: nc });
+  }
 }
 
 let lastTime = performance.now();
@@ -88,6 +261,7 @@ function loop(now) {
   lastTime = now;
 
   if (moving) {
+    dirty = true;
     const dx = targetX - localPlayer.x;
     const dy = targetY - localPlayer.y;
     const dist = Math.hypot(dx, dy);
@@ -107,8 +281,13 @@ function loop(now) {
     else if (keys['d'] || keys['arrowright']) tryStartMove(0, 1);
   }
 
-  drawMaze();
-  Object.values(otherPlayers).forEach(p => {
+  // Camera: keep the local player centred, clamped to the maze edges
+  const camX = Math.max(0, Math.min(localPlayer.x - SIZE / 2, numCols * cell - SIZE));
+  const camY = Math.max(0, Math.min(localPlayer.y - SIZE / 2, numRows * cell - SIZE));
+  ensureChunksAround(localPlayer.row, localPlayer.col);
+
+  const players = Object.values(otherPlayers);
+  players.forEach(p => {
       const dx = p.targetX - p.x;
       const dy = p.targetY - p.y;
       const dist = Math.hypot(dx, dy);
@@ -117,92 +296,152 @@ function loop(now) {
       if (dist > 0.1) {
         p.x += dx / dist * Math.min(step, dist);
         p.y += dy / dist * Math.min(step, dist);
+        dirty = true;
       }
-      drawCircle(p.x, p.y, cell * 0.35, p.img, p.username);
   });
-  drawCircle(localPlayer.x, localPlayer.y, cell * 0.35, localPlayer.img, localPlayer.username);
 
+  if (dirty) {
+    dirty = false;
+    ctx.clearRect(0, 0, SIZE, SIZE);
+    ctx.save();
+    ctx.translate(-camX, -camY);
+    drawMaze(camX, camY);
+    players.forEach(drawPlayer);
+    drawPlayer(localPlayer);
+    ctx.restore();
+  }
 
   requestAnimationFrame(loop);
 }
 requestAnimationFrame(loop);
 
-function drawMaze() {
-  ctx.clearRect(0, 0, SIZE, SIZE);
-  ctx.fillStyle = '#222';
-  for (let r = 0; r < numRows; r++)
-    for (let c = 0; c < numCols; c++)
-      if (maze[r][c]) ctx.fillRect(c * cell, r * cell, cell, cell);
+// Blits the maze layers visible from camera origin (camX, camY), in world coordinates
+function drawMaze(camX, camY) {
+  const span = LAYER * cell;
+  const r0 = Math.floor(camY / span), r1 = Math.min(Math.ceil(numRows / LAYER), Math.ceil((camY + SIZE) / span));
+  const c0 = Math.floor(camX / span), c1 = Math.min(Math.ceil(numCols / LAYER), Math.ceil((camX + SIZE) / span));
+  for (let cr = r0; cr < r1; cr++)
+    for (let cc = c0; cc < c1; cc++) {
+      const layer = mazeLayer(cr, cc);
+      if (layer) ctx.drawImage(layer, cc * span, cr * span, layer.width * cell, layer.height * cell);
+    }
   ctx.fillStyle = 'rgba(0,255,0,0.4)';
   ctx.fillRect(goalC * cell, goalR * cell, cell, cell);
 }
 
-function drawCircle(x, y, r, img, username) {
-  if (img && img.complete && img.naturalWidth > 0) {
-    ctx.save(); ctx.beginPath(); ctx.arc(x, y, r, 0, 2 * Math.PI); ctx.clip();
-    ctx.drawImage(img, x - r, y - r, 2 * r, 2 * r); ctx.restore();
-  } else {
-    ctx.fillStyle = getComputedStyle(document.documentElement).getPropertyValue('--primary-color').trim();
-    ctx.beginPath(); ctx.arc(x, y, r, 0, 2 * Math.PI); ctx.fill();
-    ctx.fillStyle = '#fff'; ctx.textAlign = 'center'; ctx.textBaseline = 'middle'; ctx.font = '8px Orbitron'; ctx.fillText(username, x, y);
-  }
+function drawPlayer(p) {
+  const sprite = spriteFor(p);
+  ctx.drawImage(sprite, Math.round(p.x - sprite.width / 2), Math.round(p.y - sprite.height / 2));
 }
 
 // Socket handlers for players
-socket.on('join_game_ack', data => {
+function addPlayer(p) {
+  if (p.username === USERNAME) return;
+  const known = otherPlayers[p.username];
+  if (known && known.avatarUrl === p.avatarUrl) {
+    // Already drawn (e.g. after a resync): glide to the new position instead of jumping
+    applyMove(p);
+    return;
+  }
+  if (known && playersById[known.id] === p.username) delete playersById[known.id];
+  playersById[p.id] = p.username;
+  otherPlayers[p.username] = {
+    id: p.id,
+    username: p.username,
+    avatarUrl: p.avatarUrl,
+    row: p.row, col: p.col,
+    x: p.col * cell + cell / 2,
+    y: p.row * cell + cell / 2,
+    targetX: p.col * cell + cell / 2,
+    targetY: p.row * cell + cell / 2,
+    img: loadAvatar(p.avatarUrl)
+  };
+  dirty = true;
+}
 
-  data.players.forEach(p => {
-    if (p.username !== USERNAME) {
-      otherPlayers[p.username] = {
-        username: p.username,
-        avatarUrl: p.avatarUrl,
-        row: p.row, col: p.col,
-        x: p.col * cell + cell / 2,
-        y: p.row * cell + cell / 2,
-        targetX: p.col * cell + cell / 2,
-        targetY: p.row * cell + cell / 2,
-        img: (() => {
-          if (!p.avatarUrl || p.avatarUrl === 'null') return null;  // Do not load invalid avatars
-          const i = new Image();
-          i.src = p.avatarUrl;
-          return i;
-        })()
-      };
-    }
-  });
+function removePlayer(username) {
+  const player = otherPlayers[username];
+  if (player && playersById[player.id] === username) delete playersById[player.id];
+  delete otherPlayers[username];
+  dirty = true;
+}
+
+function snapLocalPlayer(row, col) {
+  localPlayer.row = row;
+  localPlayer.col = col;
+  localPlayer.x = targetX = col * cell + cell / 2;
+  localPlayer.y = targetY = row * cell + cell / 2;
+  moving = false;
+  dirty = true;
+}
+
+socket.on('join_game_ack', data => {
+  protocol = data.protocol || 'json';
+  seen(data);
+  data.players.forEach(addPlayer);
+  dirty = true;
 });
 
 socket.on('player_joined', p => {
   console.log('[player_joined]', p.username, 'avatarUrl:', p.avatarUrl);
-  if (p.username !== USERNAME) {
-    otherPlayers[p.username] = {
-      ...p,
-      x: p.col * cell + cell / 2,
-      y: p.row * cell + cell / 2,
-      targetX: p.col * cell + cell/2,
-      targetY: p.row * cell + cell/2,
-      img: (() => {
-          if (!p.avatarUrl || p.avatarUrl === 'null') return null;  // Do not load invalid avatars
-          const i = new Image();
-          i.src = p.avatarUrl;
-          return i;
-        })()
-    };
+  seen(p);
+  addPlayer(p);
+});
+
+// Reconnected while the server still held our place: apply only what we missed
+socket.on('room_resync', data => {
+  console.log(`[SOCKET] Resynced at seq ${data.seq}:`, data.snapshot ? 'snapshot' : `${data.players.length} change(s)`);
+  protocol = data.protocol || 'json';
+  lastSeq = data.seq;
+  if (data.snapshot) {
+    const present = new Set(data.players.map(p => p.username));
+    Object.keys(otherPlayers).filter(u => !present.has(u)).forEach(removePlayer);
   }
+  data.left.forEach(removePlayer);
+  data.players.forEach(addPlayer);
+  snapLocalPlayer(data.row, data.col);
+  if (data.winner) showResult(data.winner);
+  else if (data.finished) showResult(null);
 });
 
 
-socket.on('player_moved', p => {
+function applyMove(p) {
+  seen(p);
   if (p.username !== USERNAME && otherPlayers[p.username]) {
     otherPlayers[p.username].row = p.row;
     otherPlayers[p.username].col = p.col;
     otherPlayers[p.username].targetX = p.col * cell + cell / 2;
     otherPlayers[p.username].targetY = p.row * cell + cell / 2;
   }
+}
+
+socket.on('player_moved', applyMove);
+// Tick mode: one frame carries the latest position of everyone who moved
+socket.on('players_moved', batch => {
+  seen(batch);
+  batch.moves.forEach(applyMove);
 });
-socket.on('player_left', username => {
-  console.log('[SOCKET] player_left:', username);
-  delete otherPlayers[username];
+// Binary format: packed little-endian uint16 (player id, row, col) records
+socket.on('moved', buffer => {
+  const view = new DataView(buffer);
+  for (let offset = 0; offset + 6 <= view.byteLength; offset += 6) {
+    const username = playersById[view.getUint16(offset, true)];
+    if (username) {
+      applyMove({ username, row: view.getUint16(offset + 2, true), col: view.getUint16(offset + 4, true) });
+    }
+  }
+});
+
+// The server dropped our last move; snap back to its authoritative position
+socket.on('move_rejected', pos => {
+  console.warn(`[MOVE] Rejected by server, resyncing to (${pos.row}, ${pos.col})`);
+  snapLocalPlayer(pos.row, pos.col);
+});
+
+socket.on('player_left', data => {
+  console.log('[SOCKET] player_left:', data.username);
+  seen(data);
+  removePlayer(data.username);
 });
 
 let gameOver = false;
@@ -224,16 +463,21 @@ function flashPrompt(msg) {
   });
 }
 
-// Used in the player_won callback
-socket.on('player_won', async data => {
+// Used in the player_won callback, and by a resync that finds the game already over
+async function showResult(winner) {
   if (gameOver) return;
   gameOver = true;
 
-  const msg = data.winner === USERNAME
+  const msg = winner === USERNAME
     ? '🎉 You Win!'
-    : `💥 ${data.winner} Wins! You Lose!`;
+    : winner ? `💥 ${winner} Wins! You Lose!` : 'Game over!';
 
   await flashPrompt(msg);
 
   window.location.href = '/';
+}
+
+socket.on('player_won', data => {
+  seen(data);
+  showResult(data.winner);
 });
@@ -0,0 +1,85 @@
+import pytest
+
+from leaderboard import RANKINGS, Leaderboard, _Board
+
+
+def user(username, won=0, played=0, level=1, exp=0):
+    return {'username': username, 'won': won, 'lose': played - won, 'played': played,
+            'level': level, 'exp': exp, 'win_rate': won / played if played else None}
+
+
+def usernames(entries):
+    return [e['username'] for e in entries]
+
+
+def board(docs, ranking='wins', capacity=3):
+    b = _Board(RANKINGS[ranking], capacity)
+    b.load(docs)
+    return b
+
+
+def test_load_orders_and_breaks_ties_by_username():
+    b = board([user('carol', won=2), user('bob', won=5), user('alice', won=2), user('dave', won=1)])
+    assert usernames(b.entries) == ['bob', 'alice', 'carol']
+    assert b.complete is False
+
+
+def test_score_update_reorders():
+    b = board([user('a', won=5), user('b', won=3), user('c', won=1)], capacity=5)
+    assert b.apply(user('c', won=6)) is True
+    assert usernames(b.entries) == ['c', 'a', 'b']
+
+
+def test_tie_after_update_is_ordered_by_username():
+    b = board([user('b', won=5), user('c', won=3)], capacity=5)
+    b.apply(user('a', won=5))
+    assert usernames(b.entries) == ['a', 'b', 'c']
+
+
+def test_unchanged_score_is_not_a_change():
+    b = board([user('a', won=5), user('b', won=3)], capacity=5)
+    assert b.apply(user('b', won=3)) is False
+
+
+def test_promotion_into_a_full_board_drops_the_last_entry():
+    b = board([user('a', won=5), user('b', won=3), user('c', won=2), user('d', won=1)])
+    b.apply(user('d', won=4))
+    assert usernames(b.entries) == ['a', 'd', 'b']
+
+
+def test_demotion_below_the_board_removes_the_entry():
+    # An unseen user might now outrank 'a', so it is dropped rather than kept last
+    b = board([user('a', won=5), user('b', won=3), user('c', won=2), user('d', won=1)])
+    b.apply(user('a', won=0))
+    assert usernames(b.entries) == ['b', 'c']
+
+
+def test_unqualified_users_stay_off_the_win_rate_board():
+    b = board([user('a', won=5, played=10)], ranking='win_rate', capacity=5)
+    b.apply(user('lucky', won=1, played=1))
+    assert usernames(b.entries) == ['a']
+
+
+@pytest.fixture
+def leaderboard():
+    mongomock = pytest.importorskip('mongomock')
+
+    class Mongo:
+        db = mongomock.MongoClient().db
+
+    Mongo.db.users.insert_many([user(f"u{i:02}", won=i, played=i) for i in range(20)])
+    lb = Leaderboard(Mongo(), size=10)
+    lb.warm()
+    return lb
+
+
+@pytest.mark.parametrize('limit, expected', [(None, 10), (0, 10), (3, 3), (10, 10), (50, 10), (-5, 1)])
+def test_top_clamps_limit(leaderboard, limit, expected):
+    top = leaderboard.top('wins', limit)
+    assert len(top) == expected
+    assert top[0]['username'] == 'u19'
+
+
+def test_top_rejects_unknown_ranking(leaderboard):
+    with pytest.raises(KeyError):
+        leaderboard.top('speed')
@@ -0,0 +1,120 @@
+from matchmaking import Matchmaker
+
+
+class FakeSocketIO:
+    """Records background tasks instead of running them; the tests call tick() themselves."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def start_background_task(self, target, *args):
+        self.tasks.append(target)
+
+    def sleep(self, seconds):
+        pass
+
+
+def matchmaker(**kwargs):
+    now = [0.0]
+    started = []
+    mm = Matchmaker(FakeSocketIO(), lambda size, players: started.append((size, players)),
+                    clock=lambda: now[0], **kwargs)
+    return mm, started, now
+
+
+def names(players):
+    return sorted(username for username, _ in players)
+
+
+def test_full_group_starts_immediately():
+    mm, started, _ = matchmaker(capacity=3)
+    assert mm.join('a', 'sa', 'classic') == 1
+    assert mm.join('b', 'sb', 'classic') == 2
+    assert started == []
+    assert mm.join('c', 'sc', 'classic') == 0
+    assert started == [('classic', [('a', 'sa'), ('b', 'sb'), ('c', 'sc')])]
+    assert mm.waiting() == 0
+    assert mm.matches == 1 and mm.matched_players == 3
+
+
+def test_groups_by_maze_size():
+    mm, started, _ = matchmaker(capacity=2)
+    mm.join('a', 'sa', 'classic')
+    mm.join('b', 'sb', 'raid')
+    assert started == []
+    assert mm.waiting_by_size() == {'classic': 1, 'raid': 1}
+    mm.join('c', 'sc', 'raid')
+    assert [(size, names(players)) for size, players in started] == [('raid', ['b', 'c'])]
+    assert mm.waiting_by_size() == {'classic': 1}
+
+
+def test_oldest_players_are_matched_first():
+    mm, started, now = matchmaker(capacity=2)
+    mm.join('a', 'sa', 'classic')
+    now[0] = 1
+    mm.join('b', 'sb', 'large')
+    mm.join('c', 'sc', 'classic')
+    assert names(started[0][1]) == ['a', 'c']
+
+
+def test_max_wait_starts_a_short_handed_group():
+    mm, started, now = matchmaker(capacity=4, min_players=2, max_wait=20)
+    mm.join('a', 'sa', 'classic')
+    mm.join('b', 'sb', 'classic')
+    now[0] = 19
+    mm.tick()
+    assert started == []
+    now[0] = 20
+    mm.tick()
+    assert [(size, names(players)) for size, players in started] == [('classic', ['a', 'b'])]
+    assert mm.timeouts == 1
+    assert mm.waiting() == 0
+
+
+def test_max_wait_needs_min_players():
+    mm, started, now = matchmaker(capacity=4, min_players=2, max_wait=20)
+    mm.join('a', 'sa', 'classic')
+    now[0] = 60
+    mm.tick()
+    assert started == []
+    assert mm.is_queued('a')
+
+
+def test_max_wait_fills_from_nearest_level_bucket():
+    mm, started, now = matchmaker(capacity=2, min_players=2, max_wait=20, level_bucket=5)
+    mm.join('novice', 's1', 'classic', level=1)
+    mm.join('far', 's2', 'classic', level=20)
+    mm.join('near', 's3', 'classic', level=7)
+    mm.join('other_size', 's4', 'raid', level=1)
+    now[0] = 20
+    mm.tick()
+    assert [names(players) for _, players in started] == [['near', 'novice']]
+    assert mm.is_queued('far') and mm.is_queued('other_size')
+
+
+def test_disconnected_player_leaves_the_queue():
+    mm, started, now = matchmaker(capacity=2, max_wait=20)
+    mm.join('a', 'sa', 'classic')
+    # A disconnect from another socket of the same user does not cancel the ticket
+    assert mm.leave('a', 'other-sid') is False
+    assert mm.is_queued('a')
+    assert mm.leave('a', 'sa') is True
+    assert not mm.is_queued('a')
+    assert mm.waiting_by_size() == {}
+    mm.join('b', 'sb', 'classic')
+    assert started == []
+    now[0] = 30
+    mm.tick()
+    assert started == []
+
+
+def test_requeue_replaces_the_earlier_ticket():
+    mm, started, _ = matchmaker(capacity=2)
+    mm.join('a', 'sa', 'classic')
+    mm.join('a', 'sa2', 'raid')
+    assert mm.waiting() == 1
+    assert mm.waiting_by_size() == {'raid': 1}
+    mm.join('b', 'sb', 'classic')
+    assert started == []
+    mm.join('c', 'sc', 'raid')
+    assert started == [('raid', [('a', 'sa2'), ('c', 'sc')])]
@@ -0,0 +1,49 @@
+"""
+The server validates moves against maze.py while browsers draw static/maze.js,
+so the two generators must agree on every cell for the same seed and size.
+"""
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from maze import get_maze
+
+MAZE_JS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'maze.js')
+
+# (seed, rows, cols): even and odd sizes, non-square, seed edge cases and a streamed size
+CASES = [
+    (0, 20, 20),
+    (1, 21, 21),
+    (42, 7, 13),
+    (123456789, 20, 20),
+    (2 ** 31 - 1, 100, 100),
+    (987654321, 150, 96),
+]
+
+RUN_JS = """
+const fs = require('fs'), vm = require('vm');
+const sandbox = { window: {} };
+vm.createContext(sandbox);
+vm.runInContext(fs.readFileSync(process.argv[1], 'utf8'), sandbox);
+const cases = JSON.parse(process.argv[2]);
+process.stdout.write(JSON.stringify(cases.map(([seed, rows, cols]) => sandbox.window.generateMaze(rows, cols, seed))));
+"""
+
+
+@pytest.fixture(scope='module')
+def js_mazes():
+    node = shutil.which('node')
+    if node is None:
+        pytest.skip('node is not installed')
+    out = subprocess.run([node, '-e', RUN_JS, MAZE_JS, json.dumps(CASES)],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out)
+
+
+@pytest.mark.parametrize('index', range(len(CASES)))
+def test_matches_static_maze_js(js_mazes, index):
+    seed, rows, cols = CASES[index]
+    assert get_maze(seed, rows, cols).to_rows() == js_mazes[index]
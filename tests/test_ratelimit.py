@@ -0,0 +1,83 @@
+import pytest
+
+from ratelimit import EventRateLimiter, parse_budgets
+
+
+def limiter(spec='move=2/4', **kwargs):
+    now = [0.0]
+    return EventRateLimiter(parse_budgets(spec, {}), clock=lambda: now[0], **kwargs), now
+
+
+def test_parse_budgets_overlays_defaults():
+    budgets = parse_budgets('move=15/30, start_game=0.2', {'move': (1.0, 1.0), 'mv': (5.0, 10.0)})
+    assert budgets == {'move': (15.0, 30.0), 'start_game': (0.2, 0.2), 'mv': (5.0, 10.0)}
+
+
+def test_burst_then_drop():
+    rl, _ = limiter()
+    assert [rl.allow('move', 's1') for _ in range(5)] == [True] * 4 + [False]
+
+
+def test_unbudgeted_events_pass():
+    rl, _ = limiter()
+    assert all(rl.allow('chat', 's1') for _ in range(100))
+
+
+def test_refill_over_time():
+    rl, now = limiter()
+    for _ in range(4):
+        rl.allow('move', 's1')
+    assert not rl.allow('move', 's1')
+    now[0] = 0.5
+    assert rl.allow('move', 's1')
+    assert not rl.allow('move', 's1')
+
+
+def test_refill_is_capped_at_burst():
+    rl, now = limiter()
+    rl.allow('move', 's1')
+    now[0] = 100
+    assert [rl.allow('move', 's1') for _ in range(5)] == [True] * 4 + [False]
+
+
+def test_user_budget_spans_sockets():
+    rl, _ = limiter(user_multiplier=1.5)
+    allowed = [rl.allow('move', sid, 'alice') for sid in ('s1', 's2') for _ in range(4)]
+    # 4 per socket, but only 6 for the account
+    assert allowed.count(True) == 6
+
+
+def test_drop_streaks_and_abuse():
+    rl, _ = limiter(abuse_drops=3)
+    assert rl.dropped('move', 's1') == (True, False)
+    assert rl.dropped('move', 's1') == (False, False)
+    rl.accepted('move', 's1')
+    assert rl.dropped('move', 's1') == (True, False)
+    assert rl.dropped('move', 's1') == (False, True)
+    assert rl.throttled == {'move': 4}
+
+
+def test_abuse_window_resets():
+    rl, now = limiter(abuse_drops=2, abuse_window=10)
+    rl.dropped('move', 's1')
+    rl.dropped('move', 's1')
+    now[0] = 11
+    assert rl.dropped('move', 's1') == (False, False)
+
+
+def test_forget_prunes_refilled_users():
+    rl, now = limiter()
+    rl.MAX_IDLE_USERS = 1
+    rl.allow('move', 's1', 'idle')
+    now[0] = 10
+    rl.allow('move', 's2', 'busy')
+    # 'idle' has had time to refill its whole bucket (6 tokens at 3/s), 'busy' has not
+    rl.forget('s1')
+    assert list(rl._users) == ['busy']
+    assert 's1' not in rl._sids
+
+
+@pytest.mark.parametrize('spec', ['move=0/5', 'move=-1/5', 'move=2/0.5', 'move=2/0', 'move=nan/3'])
+def test_invalid_budgets_are_rejected(spec):
+    with pytest.raises(ValueError):
+        limiter(spec)
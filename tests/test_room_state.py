@@ -0,0 +1,127 @@
+"""
+Both room-state backends must behave the same; the Redis one runs against
+fakeredis.
+"""
+import pytest
+
+from room_state import InMemoryRoomState, RedisRoomState
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def state(request):
+    if request.param == 'memory':
+        return InMemoryRoomState()
+    fakeredis = pytest.importorskip('fakeredis')
+    return RedisRoomState(fakeredis.FakeRedis())
+
+
+def player(username, row=1, col=1, sid='sid-1'):
+    return {'id': 0, 'username': username, 'avatarUrl': None, 'row': row, 'col': col, 'sid': sid}
+
+
+def test_create_room(state):
+    assert state.get_room('r') is None
+    assert state.create_room('r', 7, 20, 20) is True
+    assert state.get_room('r') == {'seed': 7, 'rows': 20, 'cols': 20,
+                                   'goal_row': 19, 'goal_col': 19, 'settled': False}
+
+
+def test_create_room_with_goal(state):
+    state.create_room('r', 7, 21, 21, (5, 3))
+    config = state.get_room('r')
+    assert (config['goal_row'], config['goal_col']) == (5, 3)
+
+
+def test_existing_room_is_not_recreated(state):
+    state.create_room('r', 7, 20, 20)
+    assert state.create_room('r', 8, 100, 100) is False
+    assert state.get_room('r')['seed'] == 7
+    assert state.get_room('r')['rows'] == 20
+
+
+def test_settles_once(state):
+    state.create_room('r', 7, 20, 20)
+    assert state.mark_settled('r') is True
+    assert state.mark_settled('r') is False
+    assert state.get_room('r')['settled'] is True
+
+
+def test_settled_room_stays_settled(state):
+    state.create_room('r', 7, 20, 20)
+    state.mark_settled('r')
+    state.create_room('r', 8, 20, 20)
+    assert state.get_room('r')['settled'] is True
+    assert state.mark_settled('r') is False
+
+
+def test_unknown_room_does_not_settle(state):
+    assert state.mark_settled('missing') is False
+
+
+def test_players(state):
+    state.create_room('r', 7, 20, 20)
+    state.add_player('r', player('alice'))
+    state.add_player('r', player('bob', sid='sid-2'))
+    assert sorted(state.player_names('r')) == ['alice', 'bob']
+    assert state.get_player('r', 'bob')['sid'] == 'sid-2'
+    assert state.get_player('r', 'carol') is None
+    assert sorted(state.get_players('r')) == ['alice', 'bob']
+
+    config, alice = state.get_room_and_player('r', 'alice')
+    assert config['seed'] == 7
+    state.update_position('r', alice, 1, 2)
+    assert (state.get_player('r', 'alice')['row'], state.get_player('r', 'alice')['col']) == (1, 2)
+
+
+def test_remove_player(state):
+    state.create_room('r', 7, 20, 20)
+    state.add_player('r', player('alice'))
+    assert state.remove_player('r', 'alice') is True
+    assert state.remove_player('r', 'alice') is False
+    assert state.player_names('r') == []
+    assert state.get_room('r') is not None
+
+
+def test_all_rooms_counts_rooms_with_players(state):
+    state.create_room('empty', 1, 20, 20)
+    state.create_room('r', 7, 20, 20)
+    assert state.all_rooms() == []
+    state.add_player('r', player('alice'))
+    assert state.all_rooms() == ['r']
+    state.remove_player('r', 'alice')
+    assert state.all_rooms() == []
+
+
+def test_player_ids(state):
+    state.create_room('r', 7, 20, 20)
+    assert [state.next_player_id('r') for _ in range(3)] == [0, 1, 2]
+    assert state.next_player_id('other') == 0
+
+
+def test_online_users_and_lobby_seq(state):
+    state.add_online_user('alice')
+    state.add_online_user('bob')
+    state.remove_online_user('alice')
+    assert state.online_users() == ['bob']
+    assert state.lobby_seq() == 0
+    assert state.next_lobby_seq() == 1
+    assert state.lobby_seq() == 1
+
+
+def test_unplayed_rooms_expire_in_memory():
+    now = [0.0]
+    state = InMemoryRoomState(clock=lambda: now[0])
+    state.create_room('abandoned', 1, 20, 20)
+    state.next_player_id('abandoned')
+    state.create_room('playing', 2, 20, 20)
+    state.add_player('playing', player('alice'))
+    state.create_room('won', 3, 20, 20)
+    state.mark_settled('won')
+
+    now[0] = InMemoryRoomState.ROOM_TTL
+    state.create_room('new', 4, 20, 20)
+    assert state.get_room('abandoned') is None
+    assert state.next_player_id('abandoned') == 0
+    assert state.get_room('playing') is not None
+    assert state.get_room('won')['settled'] is True
+    assert state.get_room('new') is not None
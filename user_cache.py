@@ -0,0 +1,82 @@
+"""
+Bounded TTL/LRU cache for the Flask-Login user loader.
+
+load_user runs on every authenticated request and socket event, so caching the
+User object by id keeps Mongo load proportional to the number of users rather
+than to socket traffic. Writers that change a user document (settlement, avatar
+upload) update or invalidate the cached entry.
+"""
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    def __init__(self, max_size=4096, ttl=300, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        # user id -> (expires_at, user), oldest first
+        self._entries = OrderedDict()
+        # username -> user id, for writers that only know the username
+        self._ids = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, user = entry
+        if expires_at <= self.clock():
+            self._remove(user_id)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return user
+
+    def put(self, user):
+        self._entries[user.id] = (self.clock() + self.ttl, user)
+        self._entries.move_to_end(user.id)
+        self._ids[user.username] = user.id
+        while len(self._entries) > self.max_size:
+            _, (_, oldest) = self._entries.popitem(last=False)
+            self._forget_username(oldest)
+            self.evictions += 1
+
+    def update(self, user_id, **fields):
+        """Write-through: apply changed fields to the cached user, if present."""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            for name, value in fields.items():
+                setattr(entry[1], name, value)
+
+    def invalidate(self, user_id):
+        self._remove(user_id)
+
+    def invalidate_usernames(self, usernames):
+        for username in usernames:
+            user_id = self._ids.get(username)
+            if user_id is not None:
+                self._remove(user_id)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+    def _remove(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._forget_username(entry[1])
+
+    def _forget_username(self, user):
+        if self._ids.get(user.username) == user.id:
+            del self._ids[user.username]